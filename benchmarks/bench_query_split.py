@@ -0,0 +1,75 @@
+"""
+Compare the latency of /data/ served as one Flux query against range-split execution.
+
+Run against the API of the docker-compose stack once the simulation data is ingested, e.g.
+    python benchmarks/bench_query_split.py --shard-days 0 7 14 30 --zone-shards 1 2
+Shard size 0 disables splitting (one monolithic query); speedups are relative to the first configuration.
+"""
+import time
+import json
+import argparse
+import statistics
+import urllib.parse
+import urllib.request
+
+
+def fetch(api_url, params):
+    """
+    Request /data/ once
+    :return: (seconds, number of records)
+    """
+    url = f"{api_url.rstrip('/')}/data/?{urllib.parse.urlencode(params)}"
+    started = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        records = json.load(response)
+    return time.perf_counter() - started, len(records)
+
+
+def benchmark(api_url, params, repeat):
+    """Time a request repeat times after one warm-up request"""
+    _, count = fetch(api_url, params)
+    timings = [fetch(api_url, params)[0] for _ in range(repeat)]
+    return {
+        "records": count,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single vs range-split /data/ queries")
+    parser.add_argument("--api", default="http://localhost:8000", help="Base URL of the API")
+    parser.add_argument("--data-type", default="thermal_zone", choices=["thermal_zone", "site_metrics"])
+    parser.add_argument("--resolution", default="raw", choices=["raw", "1h", "1d"])
+    parser.add_argument("--start", help="start_time of the request (default: all history)")
+    parser.add_argument("--end", help="end_time of the request (default: now)")
+    parser.add_argument("--shard-days", type=float, nargs="+", default=[0, 7, 14, 30],
+                        help="Shard sizes to compare, 0 is a single query")
+    parser.add_argument("--zone-shards", type=int, nargs="+", default=[1],
+                        help="Zone shard counts to compare")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed requests per configuration")
+    args = parser.parse_args()
+
+    base_params = {"data_type": args.data_type, "resolution": args.resolution}
+    if args.start:
+        base_params["start_time"] = args.start
+    if args.end:
+        base_params["end_time"] = args.end
+
+    print(f"{'shard_days':>10} {'zone_shards':>11} {'records':>9} {'min s':>8} {'median s':>9} {'max s':>8} {'speedup':>8}")
+    baseline = None
+    for shard_days in args.shard_days:
+        for zone_shards in args.zone_shards:
+            result = benchmark(args.api, dict(base_params, shard_days=shard_days, zone_shards=zone_shards),
+                               args.repeat)
+            if baseline is None:
+                baseline = result
+            elif result["records"] != baseline["records"]:
+                print(f"warning: {result['records']} records, the baseline returned {baseline['records']}")
+            print(f"{shard_days:>10g} {zone_shards:>11} {result['records']:>9} {result['min']:>8.3f} "
+                  f"{result['median']:>9.3f} {result['max']:>8.3f} {baseline['median'] / result['median']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
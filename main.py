@@ -1,31 +1,23 @@
-import time
+import signal
 from src.constants import FILTERED_DATA_CSV, MQTT_BROKER, MQTT_PORT
 from src.subscriber import InfluxDBStorage
 from src.publisher import PublishMetrics
-from threading import Thread
+from src.tracing import profiler, start_profiler_if_enabled
 
 
-def run_subscriber():
-    """Run the subscriber in a separate thread"""
-    storage = InfluxDBStorage()
-    try:
-        storage.start()
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\nSubscriber shutdown requested...")
-    except Exception as e:
-        print(f"Subscriber unexpected error: {e}")
-    finally:
-        storage.stop()
+def handle_sigterm(signum, frame):
+    """Shut down on SIGTERM (docker stop) the same way as on Ctrl+C"""
+    raise KeyboardInterrupt
 
 
 def run_publisher():
-    """Run the publisher after a short delay"""
-    time.sleep(1)
-
+    """Run the publisher, flushing its in-flight messages on exit"""
+    # The constructor waits (up to READY_TIMEOUT) for the broker's acknowledgement; if it has not come by then,
+    # the messages are buffered offline and sent once the publisher reconnects
     processor = PublishMetrics(FILTERED_DATA_CSV, MQTT_BROKER, MQTT_PORT)
     try:
+        if not processor.mqtt_publisher.connected:
+            print("Publisher not connected to the broker yet, buffering messages until it reconnects")
         processor.process_csv()
     except KeyboardInterrupt:
         print("\nPublisher shutting down...")
@@ -34,10 +26,21 @@ def run_publisher():
 
 
 if __name__ == "__main__":
-    subscriber_thread = Thread(target=run_subscriber)
-    subscriber_thread.daemon = True
-    subscriber_thread.start()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    start_profiler_if_enabled()
 
-    run_publisher()
-
-    subscriber_thread.join()
+    # The subscriber writes on its own threads; publishing starts once InfluxDB is healthy and the broker
+    # acknowledged its subscriptions, and it is drained after the publisher has flushed
+    storage = InfluxDBStorage()
+    try:
+        if storage.start():
+            run_publisher()
+        else:
+            print("Subscriber not ready, nothing published")
+    except KeyboardInterrupt:
+        print("\nSubscriber shutdown requested...")
+    finally:
+        try:
+            storage.stop()
+        finally:
+            profiler.stop()
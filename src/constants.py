@@ -1,5 +1,15 @@
+import os
 from pathlib import Path
 
+
+def env_flag(name, default=False):
+    """Boolean runtime toggle from the environment ('1', 'true', 'yes' or 'on' enable it)"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 PROJECT_ROOT = Path(__file__).parent.parent.resolve()
 
 IDF_PATH = PROJECT_ROOT / 'src/input/opt_bldg.idf'
@@ -13,3 +23,62 @@ BUCKET_TOKEN = "AfXeKdMKMZUK1QFbkf283YLQDAghSS5LYblxxHJyAJm2cNeoYOYqr0AdjO-qgZZs
 INFLUXDB_ORG = "gp2"
 INFLUXDB_BUCKET = "gp2"
 INFLUXDB_URL = "http://localhost:8086"
+
+# Tracing and profiling (both disabled by default, enabled with TRACING_ENABLED=1 / PROFILER_ENABLED=1)
+TRACING_ENABLED = env_flag("TRACING_ENABLED")
+TRACE_OUTPUT_PATH = PROJECT_ROOT / 'output/traces.jsonl'
+PROFILER_ENABLED = env_flag("PROFILER_ENABLED")
+PROFILER_INTERVAL = 0.005  # seconds between stack samples
+PROFILER_WINDOW = float(os.environ.get("PROFILER_WINDOW", 60))  # seconds of sampling before the profile is dumped
+PROFILE_OUTPUT_PATH = PROJECT_ROOT / 'output/profile.folded'
+
+# EnergyPlus simulation runner
+ENERGYPLUS_EXECUTABLE = "energyplus"
+SIMULATION_CACHE_DIR = PROJECT_ROOT / 'output/simulation_cache'
+WEATHER_CACHE_DIR = PROJECT_ROOT / 'output/weather_cache'
+ZONE_INDEX_CACHE_DIR = PROJECT_ROOT / 'output/zone_index_cache'
+
+# Rollups kept by the subscriber (window name -> size in seconds)
+ROLLUPS_ENABLED = True
+ROLLUP_WINDOWS = {"1h": 3600, "1d": 86400}
+ROLLUP_ALLOWED_LATENESS = 600  # seconds of event time a window stays open after its end
+ROLLUP_RETENTION = 86400  # seconds of event time a closed window can still be corrected by late data
+ROLLUP_SAMPLE_HOURS = 10 / 60  # duration of one EnergyPlus timestep, used for the PPD > 10% hours
+
+# Streaming per-zone statistics and anomaly alerts
+STATS_ENABLED = True
+STATS_FIELDS = ["mean_air_temperature", "air_relative_humidity", "air_co2_concentration"]
+STATS_QUANTILES = (0.5, 0.999)  # the last quantile is the alert threshold
+STATS_EWMA_ALPHA = 0.1
+STATS_Z_THRESHOLD = 4.0
+STATS_MIN_SAMPLES = 144  # one simulated day of 10-minute samples before readings are scored
+STATS_PUBLISH_INTERVAL = 10  # seconds between two retained statistics snapshots of a zone
+
+# Startup readiness and shutdown drain
+READY_TIMEOUT = 30  # seconds to wait for the broker acknowledgements and a healthy InfluxDB
+DRAIN_TIMEOUT = 30  # seconds allowed to flush in-flight messages and drain queued writes on shutdown
+WRITE_QUEUE_SIZE = 10000  # received messages buffered ahead of the InfluxDB writer thread
+DRAIN_QUIET_PERIOD = 1.0  # seconds without a received message before the subscriber stops receiving
+
+# MQTT publisher reconnection and offline buffering
+RECONNECT_MIN_DELAY = 0.5  # seconds before the first reconnection attempt
+RECONNECT_MAX_DELAY = 30  # cap of the exponential backoff between attempts
+PUBLISH_TIMEOUT = 10  # seconds a publish waits to be written before it is considered lost with the connection
+OFFLINE_BUFFER_SIZE = 100_000  # messages buffered in memory while the broker is unreachable
+OFFLINE_SPOOL_DIR = None  # directory the buffer overflows to, e.g. PROJECT_ROOT / 'output/mqtt_spool' (None: drop)
+OFFLINE_SPOOL_SIZE = 1_000_000  # messages held in the spool file
+OFFLINE_DRAIN_BATCH = 1000  # buffered messages handed to the client per network loop iteration
+
+# Horizontally scaled subscribers (see src/subscriber_group.py)
+SUBSCRIBER_GROUP = "influxdb_writers"  # shared subscription group of the subscriber processes
+TOPIC_PARTITIONS = 0  # topic partitions of the metrics (0: unpartitioned); publishers and subscribers must agree
+
+# Retained latest-state snapshots of every zone and site (building[/<building_id>]/zones/<zone_id>/state)
+STATE_SNAPSHOTS_ENABLED = False
+STATE_PUBLISH_INTERVAL = 10  # seconds between two retained snapshots of a zone or of the site
+
+# Storage backend of the subscriber, read from the environment like the API's (see src/fast_api/api.py):
+# "influx" writes to InfluxDB, "columnar" to the embedded store in COLUMNAR_STORE_DIR (no external service)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "influx")
+COLUMNAR_STORE_DIR = Path(os.environ.get("COLUMNAR_STORE_DIR", PROJECT_ROOT / 'output/columnar'))
+COLUMNAR_SEGMENT_ROWS = 65536  # points per segment file of a series
@@ -1,9 +1,19 @@
-from fastapi import FastAPI, HTTPException, Query
-from influxdb_client import InfluxDBClient
-from datetime import datetime
-from typing import Optional, List, Union, Dict
+import os
+import json
+import time
+import base64
+import hashlib
+import itertools
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Union, Dict, Tuple
 from pydantic import BaseModel
 import statistics
+from stats_feed import StatsFeed
+from query_gate import QueryGate, QueryShed
+from query_planner import RangeSplitter, merge_tables, plan_time_shards, plan_zone_shards
+from storage import SeriesQuery, open_backend, record_key
+from content_encoding import CompressionMiddleware
 
 # INFLUXDB_URL = "http://localhost:8086"
 INFLUXDB_URL = "http://influxdb:8086"
@@ -11,13 +21,64 @@ BUCKET_TOKEN = "AfXeKdMKMZUK1QFbkf283YLQDAghSS5LYblxxHJyAJm2cNeoYOYqr0AdjO-qgZZs
 INFLUXDB_ORG = "gp2"
 INFLUXDB_BUCKET = "gp2"
 
+# Storage backend serving the queries: "influx", or "columnar" to read the embedded store the subscriber writes
+# to COLUMNAR_STORE_DIR (mount the same directory into both), without an InfluxDB server
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "influx")
+COLUMNAR_STORE_DIR = os.environ.get("COLUMNAR_STORE_DIR", "/data/columnar")
+
+# MQTT_BROKER = "localhost"
+MQTT_BROKER = "mosquitto"
+MQTT_PORT = 1883
+
+# Storage queries executed at once, and queries allowed to wait before new ones are answered with 503
+INFLUX_MAX_CONCURRENT_QUERIES = 4
+INFLUX_MAX_QUEUED_QUERIES = 32
+# Shard queries one split request runs at once: half of the gate, so concurrent requests still get slots
+SPLIT_PARALLELISM = max(1, INFLUX_MAX_CONCURRENT_QUERIES // 2)
+
+# Zone topology exported by `python -m src.topology --export src/fast_api/zone_index.json`
+ZONE_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zone_index.json")
+
+# Requests spanning more than these many seconds are served from the subscriber's rollup measurements
+ROLLUP_ROUTES = [(30 * 86400, "1d"), (2 * 86400, "1h")]
+RESOLUTIONS = ("auto", "raw", "1h", "1d")
+
+# Span of the time shards a /data/ range is split into, per resolution (None: never split).
+# The shards of a request run concurrently, at most SPLIT_PARALLELISM queries at once.
+DATA_SHARD_SPANS = {"raw": timedelta(days=14), "1h": timedelta(days=180), "1d": None}
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are compressed (zstd or br when installed, otherwise gzip)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+
+# Ranges ending this long before the newest ingested point no longer change and get a strong ETag.
+# Rollup windows are written once closed and can be corrected by late data for a day (ROLLUP_RETENTION).
+SETTLED_AFTER = {"raw": timedelta(0), "1h": timedelta(days=1, hours=1), "1d": timedelta(days=2)}
+LATEST_INGESTED_TTL = 5  # seconds the time of the newest ingested point is cached for
+
+# Largest page of /data/ records or /temperatures/ timesteps a paginated request can ask for
+MAX_PAGE_LIMIT = 100_000
+
 app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE, level=COMPRESSION_LEVEL)
 
-client = InfluxDBClient(url=INFLUXDB_URL, token=BUCKET_TOKEN, org=INFLUXDB_ORG)
+if STORAGE_BACKEND == "columnar":
+    backend = open_backend("columnar", root=COLUMNAR_STORE_DIR)
+else:
+    backend = open_backend(STORAGE_BACKEND, url=INFLUXDB_URL, token=BUCKET_TOKEN, org=INFLUXDB_ORG,
+                           bucket=INFLUXDB_BUCKET)
+stats_feed = StatsFeed(MQTT_BROKER, MQTT_PORT)
+query_gate = QueryGate(INFLUX_MAX_CONCURRENT_QUERIES, INFLUX_MAX_QUEUED_QUERIES)
+
+# Data generation marker of the backend, which rewrites and deletes change (see data_generation())
+generation_cache = {"generation": None, "expires": 0.0}
+# (time, expiry) of latest_ingested() by building_id (None for the whole fleet)
+latest_ingested_cache = {}
 
 
 class ThermalZoneData(BaseModel):
     zone_id: str
+    building_id: Optional[str] = None
     time: datetime
     mean_air_temperature: Optional[float] = None
     operative_temperature: Optional[float] = None
@@ -35,6 +96,7 @@ class ThermalZoneData(BaseModel):
 
 class SiteMetricsData(BaseModel):
     time: datetime
+    building_id: Optional[str] = None
     interior_lights_electricity: Optional[float] = None
     facility_electricity: Optional[float] = None
     outdoor_air_temp: Optional[float] = None
@@ -42,6 +104,35 @@ class SiteMetricsData(BaseModel):
     direct_solar_radiation: Optional[float] = None
 
 
+class ZoneInfo(BaseModel):
+    zone_id: str
+    block: Optional[str] = None
+    floor: Optional[str] = None
+    floor_area: Optional[float] = None
+    volume: Optional[float] = None
+
+
+class ZoneTopology(BaseModel):
+    zones: List[ZoneInfo]
+    blocks: Dict[str, List[str]]
+    floors: Dict[str, List[str]]
+
+
+class FieldStatistics(BaseModel):
+    count: int
+    mean: float
+    std: float
+    ewma: float
+    quantiles: Dict[str, Optional[float]]
+
+
+class ZoneStatistics(BaseModel):
+    zone_id: str
+    building_id: Optional[str] = None
+    time: Optional[datetime] = None
+    fields: Dict[str, FieldStatistics]
+
+
 class TemperatureReading(BaseModel):
     zone_id: Optional[str] = None
     temperature: Optional[float] = None
@@ -50,187 +141,568 @@ class TemperatureReading(BaseModel):
 class TimestepTemperature(BaseModel):
     time: datetime
     outdoor_temp: Optional[float] = None
+    outdoor_temp_by_building: Optional[Dict[str, float]] = None
     indoor_temps: Union[Dict[str, float], float, None]
 
 
-def format_time(dt: Optional[Union[datetime, str]]) -> str:
-    """Format datetime for InfluxDB query"""
-    if dt is None:
-        return ""
+def load_zone_index(path: str) -> Tuple[Dict[str, ZoneInfo], set]:
+    """
+    Load the zone topology index, keyed by zone_id (empty if the index was not exported)
+    :return: (zones, fleet building IDs built from the indexed IDF)
+    """
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+        return {zone["zone_id"]: ZoneInfo(**zone) for zone in index["zones"]}, set(index.get("buildings", []))
+    except FileNotFoundError:
+        print(f"Zone index {path} not found, zone validation and grouping are disabled")
+        return {}, set()
+
+
+ZONES, INDEXED_BUILDINGS = load_zone_index(ZONE_INDEX_PATH)
+
+
+def indexed(building_id: Optional[str]) -> bool:
+    """Whether the zone index describes a building (the single-building data, or a fleet building of its IDF)"""
+    return bool(ZONES) and (building_id is None or building_id in INDEXED_BUILDINGS)
+
 
+def group_zones(attribute: str) -> Dict[str, List[str]]:
+    groups = {}
+    for zone in ZONES.values():
+        value = getattr(zone, attribute)
+        if value:
+            groups.setdefault(value, []).append(zone.zone_id)
+    return groups
+
+
+def resolve_zones(zone_id: Optional[str], floor: Optional[str], block: Optional[str],
+                  building_id: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Zone IDs selected by the zone filters of a request
+    Zones of fleet buildings simulated from other IDFs are not in the index: their zone_id is passed through.
+    :return: None when no zone filter applies, otherwise the (possibly empty) list of selected zones
+    """
+    if indexed(building_id) and zone_id is not None and zone_id not in ZONES:
+        raise HTTPException(status_code=404, detail=f"Unknown zone_id '{zone_id}'")
+    if (floor or block) and not ZONES:
+        raise HTTPException(status_code=400, detail="Zone index not available, cannot filter by floor or block")
+    if (floor or block) and not indexed(building_id):
+        raise HTTPException(status_code=400, detail=f"Building '{building_id}' is not in the zone index, "
+                                                    f"cannot filter by floor or block")
+    if not (zone_id or floor or block):
+        return None
+
+    zone_ids = [zone_id] if zone_id else list(ZONES)
+    for attribute, value in (("floor", floor), ("block", block)):
+        if value:
+            groups = group_zones(attribute)
+            if value not in groups:
+                raise HTTPException(status_code=404, detail=f"Unknown {attribute} '{value}'")
+            zone_ids = [zone for zone in zone_ids if zone in groups[value]]
+    return zone_ids
+
+
+def parse_time(dt: Union[datetime, str]) -> datetime:
     if isinstance(dt, str):
         # Handle both 'Z' and '+00:00' timezone formats
         if dt.endswith('Z'):
             dt = dt[:-1] + '+00:00'
         dt = datetime.fromisoformat(dt)
+    return dt
+
 
-    return dt.isoformat().replace('+00:00', 'Z')
+def to_utc(dt: Union[datetime, str]) -> datetime:
+    """Parse a request time, reading naive times as UTC"""
+    dt = parse_time(dt)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
 
 
-def build_thermal_zone_query(zone_id: Optional[str], start_time: str, end_time: str) -> str:
-    zone_filter = f'r.zone_id == "{zone_id}"' if zone_id else 'true'
-    return f"""
-    from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: {start_time}, stop: {end_time})
-      |> filter(fn: (r) => r._measurement == "thermal_zone" and {zone_filter})
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-      |> keep(columns: ["_time", "zone_id", "mean_air_temperature", "operative_temperature", 
-                        "air_relative_humidity", "air_co2_concentration", 
-                        "infiltration_air_change_rate", "mech_ventilation_air_changes", 
-                        "internal_latent_gain", "cooling_rate", "heating_rate", 
-                        "people_sensible_heat", "thermal_comfort_pmv", "thermal_comfort_ppd"])
+async def choose_resolution(resolution: str, start_time: Optional[Union[datetime, str]],
+                            end_time: Optional[Union[datetime, str]], measurements: List[str],
+                            zone_ids: Optional[List[str]] = None, building_id: Optional[str] = None) -> str:
     """
+    Resolve the data source of a request: 'raw' points or a rollup window ('1h', '1d')
+    With 'auto', the span of the request picks the source (an open start spans all history). Rollups only exist
+    for the data ingested while the subscriber kept them, so 'auto' falls back to raw points when a measurement
+    of the request has no rollup in its range.
+    :param measurements: Measurements the request reads
+    """
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if resolution != "auto":
+        return resolution
+
+    start = to_utc(start_time) if start_time else None
+    stop = to_utc(end_time) if end_time else None
+    window = "raw"
+    if start is None:
+        window = ROLLUP_ROUTES[0][1]
+    else:
+        span = ((stop or datetime.now(timezone.utc)) - start).total_seconds()
+        window = next((window for threshold, window in ROLLUP_ROUTES if span > threshold), "raw")
+
+    if window != "raw":
+        for measurement in measurements:
+            if await data_bounds(measurement, window, zone_ids, building_id, start, stop) is None:
+                return "raw"
+    return window
+
+
+async def run_query(query: SeriesQuery):
+    """Run a query on the storage backend through the query gate, sharing the result with identical in-flight queries"""
+    try:
+        return await query_gate.run(query, lambda: backend.query(query))
+    except QueryShed as e:
+        raise HTTPException(status_code=503, detail=f"Storage is overloaded: {e}", headers={"Retry-After": "1"})
+
+
+range_splitter = RangeSplitter(run_query, SPLIT_PARALLELISM)
+
+
+async def data_bounds(measurement: str, resolution: str, zone_ids: Optional[List[str]] = None,
+                      building_id: Optional[str] = None, start: Optional[datetime] = None,
+                      stop: Optional[datetime] = None):
+    """
+    Time of the first and just after the last point of a measurement, within [start, stop) when given
+    :return: (first, stop) datetimes, or None when there is no data
+    """
+    query = SeriesQuery(measurement, start, stop, zone_tuple(zone_ids), building_id, resolution=resolution)
+    try:
+        bounds = await query_gate.run(("bounds", query), lambda: backend.bounds(query))
+    except QueryShed as e:
+        raise HTTPException(status_code=503, detail=f"Storage is overloaded: {e}", headers={"Retry-After": "1"})
+    if bounds is None:
+        return None
+    return bounds[0], bounds[1] + timedelta(seconds=1)
+
+
+def zone_tuple(zone_ids: Optional[List[str]]) -> Optional[Tuple[str, ...]]:
+    return tuple(zone_ids) if zone_ids is not None else None
 
 
-def build_site_metrics_query(start_time: str, end_time: str) -> str:
-    return f"""
-    from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: {start_time}, stop: {end_time})
-      |> filter(fn: (r) => r._measurement == "site_metrics")
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-      |> keep(columns: ["_time", "interior_lights_electricity", "facility_electricity", 
-                        "outdoor_air_temp", "diffuse_solar_radiation", "direct_solar_radiation"])
+async def plan_shards(measurement: str, resolution: str, zone_ids: Optional[List[str]], building_id: Optional[str],
+                      start_time: Optional[Union[datetime, str]], end_time: Optional[Union[datetime, str]],
+                      shard_span: Optional[timedelta]):
     """
+    [start, stop) ranges a request is split into (None for an open end)
+    An open start or end is bounded by the stored data first, so no shard covers a span without data.
+    """
+    start = to_utc(start_time) if start_time else None
+    stop = to_utc(end_time) if end_time else None
+    requested = (start, stop)
+    if not shard_span:
+        return [requested]
+
+    if start is None or stop is None:
+        bounds = await data_bounds(measurement, resolution, zone_ids, building_id)
+        if bounds is None:
+            return [requested]
+        start = max(start, bounds[0]) if start else bounds[0]
+        stop = min(stop, bounds[1]) if stop else bounds[1]
+    if start >= stop:
+        return [requested]
+    return plan_time_shards(start, stop, shard_span)
+
+
+async def latest_ingested(building_id: Optional[str] = None) -> Optional[datetime]:
+    """
+    Time up to which every building in scope has sent its readings: the oldest of their newest raw points, over
+    thermal zones and site metrics, cached for LATEST_INGESTED_TTL seconds. Each building publishes its readings
+    in time order, so ranges ending at or before it are complete; buildings are not in step with each other,
+    hence the oldest over the fleet without a building_id.
+    """
+    now = time.monotonic()
+    cached = latest_ingested_cache.get(building_id)
+    if cached is None or now >= cached[1]:
+        latest = None
+        for measurement in ("thermal_zone", "site_metrics"):
+            query = SeriesQuery(measurement, building_id=building_id)
+            try:
+                newest = await query_gate.run(("latest", query), lambda: backend.latest_by_building(query))
+            except QueryShed as e:
+                raise HTTPException(status_code=503, detail=f"Storage is overloaded: {e}",
+                                    headers={"Retry-After": "1"})
+            if not newest:
+                latest = None
+                break
+            oldest = min(newest.values())
+            latest = oldest if latest is None else min(latest, oldest)
+        cached = latest_ingested_cache[building_id] = (latest, now + LATEST_INGESTED_TTL)
+    return cached[0]
+
+
+async def data_generation() -> Optional[str]:
+    """
+    Data generation marker of the storage backend, cached for LATEST_INGESTED_TTL seconds. It is persisted by the
+    backend and changes when points are rewritten, backfilled or deleted, by any process, so ETags derived from it
+    survive restarts and are shared by the API workers.
+    """
+    now = time.monotonic()
+    if now >= generation_cache["expires"]:
+        try:
+            generation = await query_gate.run(("generation",), backend.generation)
+        except QueryShed as e:
+            raise HTTPException(status_code=503, detail=f"Storage is overloaded: {e}", headers={"Retry-After": "1"})
+        generation_cache.update(generation=generation, expires=now + LATEST_INGESTED_TTL)
+    return generation_cache["generation"]
+
+
+async def historical_etag(request: Request, resolution: str, end_time: Optional[Union[datetime, str]],
+                          building_id: Optional[str] = None) -> Optional[str]:
+    """
+    Strong ETag of a request whose range has settled (see SETTLED_AFTER), derived from its parameters and the
+    data generation
+    :param building_id: Building the request is scoped to (None for the whole fleet)
+    :return: None for open or recent ranges, whose response can still change
+    """
+    if not end_time:
+        return None
+    latest = await latest_ingested(building_id)
+    if latest is None or to_utc(end_time) + SETTLED_AFTER[resolution] > latest:
+        return None
+    generation = await data_generation()
+    key = json.dumps([request.url.path, sorted(request.query_params.multi_items()), resolution, generation])
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+async def check_not_modified(request: Request, response: Response, resolution: str,
+                             end_time: Optional[Union[datetime, str]],
+                             building_id: Optional[str] = None) -> Optional[Response]:
+    """
+    Tag the response of a settled range with its ETag
+    :return: A 304 response if the request's If-None-Match already names it, otherwise None
+    """
+    etag = await historical_etag(request, resolution, end_time, building_id)
+    if etag is None:
+        return None
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def encode_cursor(position: dict) -> str:
+    """Opaque pagination cursor of a keyset position"""
+    data = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
 
 
-def process_thermal_zone_data(tables) -> List[ThermalZoneData]:
+def decode_cursor(cursor: str, required: List[str]) -> dict:
+    """Keyset position of a cursor made by encode_cursor(), with its required keys"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(position, dict) or any(key not in position for key in required):
+            raise ValueError(cursor)
+        position["t"] = to_utc(position["t"])
+        return position
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(request: Request, response: Response, cursor: Optional[str]):
+    """Point the client to the next page, in X-Next-Cursor and a Link header (no header on the last page)"""
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
+
+
+async def data_page(measurements: List[str], zone_ids: Optional[List[str]], building_id: Optional[str],
+                    start_time: Optional[Union[datetime, str]], end_time: Optional[Union[datetime, str]],
+                    resolution: str, limit: int, cursor: Optional[str]):
+    """
+    Page of the records of the measurements in turn, each in (time, building_id, zone_id) order.
+    The keyset position of the cursor moves the range start and every series returns at most limit points,
+    so a page costs the same however deep into the range it is.
+    :return: ([(measurement, record)], cursor of the next page or None on the last page)
+    """
+    position = decode_cursor(cursor, ["m", "t", "b", "z"]) if cursor else None
+    if position is not None:
+        if position["m"] not in measurements:
+            raise HTTPException(status_code=400, detail="Cursor does not belong to this data_type")
+        measurements = measurements[measurements.index(position["m"]):]
+
+    page = []
+    for measurement in measurements:
+        after = None
+        if position is not None and measurement == position["m"]:
+            after = (position["t"], position["b"], position["z"])
+        tables = await run_query(SeriesQuery(
+            measurement, to_utc(start_time) if start_time else None, to_utc(end_time) if end_time else None,
+            zone_tuple(zone_ids) if measurement == "thermal_zone" else None, building_id,
+            resolution=resolution, after=after, limit=limit - len(page)))
+        page += [(measurement, record) for record in itertools.islice(merge_tables(tables), limit - len(page))]
+        if len(page) == limit:
+            break
+
+    if len(page) < limit:
+        return page, None
+    measurement, record = page[-1]
+    timestamp, building, zone = record_key(record)
+    return page, encode_cursor({"m": measurement, "t": timestamp.isoformat(), "b": building, "z": zone})
+
+
+async def iterate(records):
+    """Async iterator over the records of a page, as consumed by the process_*_data functions"""
+    for record in records:
+        yield record
+
+
+async def process_thermal_zone_data(records) -> List[ThermalZoneData]:
     data = []
-    for table in tables:
-        for row in table.records:
-            data.append(ThermalZoneData(
-                zone_id=row.values["zone_id"],
-                time=row.values["_time"],
-                mean_air_temperature=row.values.get("mean_air_temperature"),
-                operative_temperature=row.values.get("operative_temperature"),
-                air_relative_humidity=row.values.get("air_relative_humidity"),
-                air_co2_concentration=row.values.get("air_co2_concentration"),
-                infiltration_air_change_rate=row.values.get("infiltration_air_change_rate"),
-                mech_ventilation_air_changes=row.values.get("mech_ventilation_air_changes"),
-                internal_latent_gain=row.values.get("internal_latent_gain"),
-                cooling_rate=row.values.get("cooling_rate"),
-                heating_rate=row.values.get("heating_rate"),
-                people_sensible_heat=row.values.get("people_sensible_heat"),
-                thermal_comfort_pmv=row.values.get("thermal_comfort_pmv"),
-                thermal_comfort_ppd=row.values.get("thermal_comfort_ppd")
-            ))
+    async for row in records:
+        data.append(ThermalZoneData(
+            zone_id=row.values["zone_id"],
+            building_id=row.values.get("building_id"),
+            time=row.values["_time"],
+            mean_air_temperature=row.values.get("mean_air_temperature"),
+            operative_temperature=row.values.get("operative_temperature"),
+            air_relative_humidity=row.values.get("air_relative_humidity"),
+            air_co2_concentration=row.values.get("air_co2_concentration"),
+            infiltration_air_change_rate=row.values.get("infiltration_air_change_rate"),
+            mech_ventilation_air_changes=row.values.get("mech_ventilation_air_changes"),
+            internal_latent_gain=row.values.get("internal_latent_gain"),
+            cooling_rate=row.values.get("cooling_rate"),
+            heating_rate=row.values.get("heating_rate"),
+            people_sensible_heat=row.values.get("people_sensible_heat"),
+            thermal_comfort_pmv=row.values.get("thermal_comfort_pmv"),
+            thermal_comfort_ppd=row.values.get("thermal_comfort_ppd")
+        ))
     return data
 
 
-def process_site_metrics_data(tables) -> List[SiteMetricsData]:
+async def process_site_metrics_data(records) -> List[SiteMetricsData]:
     data = []
-    for table in tables:
-        for row in table.records:
-            data.append(SiteMetricsData(
-                time=row.values["_time"],
-                interior_lights_electricity=row.values.get("interior_lights_electricity"),
-                facility_electricity=row.values.get("facility_electricity"),
-                outdoor_air_temp=row.values.get("outdoor_air_temp"),
-                diffuse_solar_radiation=row.values.get("diffuse_solar_radiation"),
-                direct_solar_radiation=row.values.get("direct_solar_radiation")
-            ))
+    async for row in records:
+        data.append(SiteMetricsData(
+            time=row.values["_time"],
+            building_id=row.values.get("building_id"),
+            interior_lights_electricity=row.values.get("interior_lights_electricity"),
+            facility_electricity=row.values.get("facility_electricity"),
+            outdoor_air_temp=row.values.get("outdoor_air_temp"),
+            diffuse_solar_radiation=row.values.get("diffuse_solar_radiation"),
+            direct_solar_radiation=row.values.get("direct_solar_radiation")
+        ))
     return data
 
 
 @app.get("/data/", response_model=Union[
     List[ThermalZoneData], List[SiteMetricsData], List[Union[ThermalZoneData, SiteMetricsData]]])
 async def get_data(
+        request: Request,
+        response: Response,
         data_type: Optional[str] = None,
         zone_id: Optional[str] = None,
+        building_id: Optional[str] = None,
         start_time: Optional[Union[datetime, str]] = None,
-        end_time: Optional[Union[datetime, str]] = None
+        end_time: Optional[Union[datetime, str]] = None,
+        floor: Optional[str] = None,
+        block: Optional[str] = None,
+        resolution: str = Query(
+            "raw",
+            description="'raw', '1h' or '1d' rollup means; 'auto' picks rollups for long ranges when they exist"
+        ),
+        shard_days: Optional[float] = Query(
+            None, ge=0,
+            description="Days per time shard of long ranges, queried concurrently (0 disables splitting); "
+                        "defaults to the span of the resolution"
+        ),
+        zone_shards: int = Query(
+            1, ge=1,
+            description="Groups of zones queried concurrently within each time shard"
+        ),
+        limit: Optional[int] = Query(
+            None, ge=1, le=MAX_PAGE_LIMIT,
+            description="Records per page; the cursor of the next page is returned in X-Next-Cursor (and Link)"
+        ),
+        cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page")
 ):
     """
-    Retrieve data from InfluxDB with optional filters.
+    Retrieve data from the storage backend with optional filters.
+    Long ranges are split into time shards queried concurrently; records are returned in time order.
+    Settled historical ranges carry a strong ETag and are answered with 304 when If-None-Match matches it.
+    With a limit, one page is returned (thermal zones, then site metrics) and shards are not used.
     """
-    query_api = client.query_api()
+    zone_ids = resolve_zones(zone_id, floor, block, building_id)
+    measurements = [data_type] if data_type else ["thermal_zone", "site_metrics"]
+    resolution = await choose_resolution(resolution, start_time, end_time, measurements, zone_ids, building_id)
+    not_modified = await check_not_modified(request, response, resolution, end_time, building_id)
+    if not_modified is not None:
+        return not_modified
+    shard_span = DATA_SHARD_SPANS[resolution] if shard_days is None else timedelta(days=shard_days)
 
     try:
-        # Handle time range
-        range_start = format_time(start_time) if start_time else "0"
-        range_stop = format_time(end_time) if end_time else "now()"
+        if limit is not None:
+            page, next_cursor = await data_page(measurements, zone_ids, building_id, start_time, end_time,
+                                                resolution, limit, cursor)
+            set_next_cursor(request, response, next_cursor)
+            thermal_zone_data = await process_thermal_zone_data(
+                iterate(record for measurement, record in page if measurement == "thermal_zone"))
+            site_metrics_data = await process_site_metrics_data(
+                iterate(record for measurement, record in page if measurement == "site_metrics"))
+            return thermal_zone_data + site_metrics_data
 
         thermal_zone_data = []
         site_metrics_data = []
 
         if data_type == "thermal_zone" or data_type is None:
-            thermal_zone_query = build_thermal_zone_query(zone_id, range_start, range_stop)
-            thermal_zone_tables = query_api.query(thermal_zone_query)
-            thermal_zone_data = process_thermal_zone_data(thermal_zone_tables)
+            shards = await plan_shards("thermal_zone", resolution, zone_ids, building_id,
+                                       start_time, end_time, shard_span)
+            zone_groups = [zone_ids]
+            if zone_shards > 1:
+                # Without a zone filter, the zones to split come from the zone index (if it covers the building)
+                indexed_zones = list(ZONES) if indexed(building_id) else None
+                zone_groups = plan_zone_shards(indexed_zones if zone_ids is None else zone_ids, zone_shards)
+            thermal_zone_data = await process_thermal_zone_data(range_splitter.records(
+                lambda start, stop, zones: SeriesQuery("thermal_zone", start, stop, zone_tuple(zones), building_id,
+                                                       resolution=resolution),
+                shards, zone_groups))
 
             if data_type == "thermal_zone":
                 return thermal_zone_data
 
         if data_type == "site_metrics" or data_type is None:
-            site_metrics_query = build_site_metrics_query(range_start, range_stop)
-            site_metrics_tables = query_api.query(site_metrics_query)
-            site_metrics_data = process_site_metrics_data(site_metrics_tables)
+            shards = await plan_shards("site_metrics", resolution, None, building_id,
+                                       start_time, end_time, shard_span)
+            site_metrics_data = await process_site_metrics_data(range_splitter.records(
+                lambda start, stop, zones: SeriesQuery("site_metrics", start, stop, building_id=building_id,
+                                                       resolution=resolution),
+                shards, [None]))
 
             if data_type == "site_metrics":
                 return site_metrics_data
 
         return thermal_zone_data + site_metrics_data
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/temperatures/", response_model=List[TimestepTemperature])
 async def get_temperatures(
+        request: Request,
+        response: Response,
         zone_id: Optional[str] = None,
+        building_id: Optional[str] = None,
         start_time: Optional[Union[datetime, str]] = None,
         end_time: Optional[Union[datetime, str]] = None,
         aggregate: Optional[bool] = Query(
             False,
             description="If True, returns mean of all thermal zones. If False, returns individual zone temperatures"
-        )
+        ),
+        floor: Optional[str] = None,
+        block: Optional[str] = None,
+        group_by: Optional[str] = Query(
+            None,
+            description="'floor' or 'block' to return the mean temperature of each group instead of each zone"
+        ),
+        resolution: str = Query(
+            "raw",
+            description="'raw', '1h' or '1d' rollup means; 'auto' picks rollups for long ranges when they exist"
+        ),
+        limit: Optional[int] = Query(
+            None, ge=1, le=MAX_PAGE_LIMIT,
+            description="Timesteps per page; the cursor of the next page is returned in X-Next-Cursor (and Link)"
+        ),
+        cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page")
 ):
     """
     Retrieve organized temperature data with clear timestep structure.
+    Without a building_id, readings of fleet buildings are keyed as "<building_id>/<zone_id>" and their outdoor
+    temperatures are returned in outdoor_temp_by_building (readings without a building_id as "default");
+    outdoor_temp is then only set for readings without a building_id or when a single building has readings.
+    Settled historical ranges carry a strong ETag and are answered with 304 when If-None-Match matches it.
+    With a limit, one page of timesteps is returned.
     """
-    query_api = client.query_api()
+    zone_ids = resolve_zones(zone_id, floor, block, building_id)
+    if group_by not in (None, "floor", "block"):
+        raise HTTPException(status_code=400, detail="group_by must be 'floor' or 'block'")
+    resolution = await choose_resolution(resolution, start_time, end_time, ["thermal_zone", "site_metrics"],
+                                         zone_ids, building_id)
+    not_modified = await check_not_modified(request, response, resolution, end_time, building_id)
+    if not_modified is not None:
+        return not_modified
 
     try:
         # Handle time range
-        range_start = format_time(start_time) if start_time else "0"
-        range_stop = format_time(end_time) if end_time else "now()"
+        range_start = to_utc(start_time) if start_time else None
+        range_stop = to_utc(end_time) if end_time else None
+
+        # Pages are keyed by timestep: the next one starts after the last timestep of the cursor
+        after = (decode_cursor(cursor, ["t"])["t"],) if cursor else None
 
         # Query outdoor temperatures
-        outdoor_query = f"""
-        from(bucket: "{INFLUXDB_BUCKET}")
-          |> range(start: {range_start}, stop: {range_stop})
-          |> filter(fn: (r) => r._measurement == "site_metrics")
-          |> filter(fn: (r) => r._field == "outdoor_air_temp")
-          |> keep(columns: ["_time", "_value"])
-        """
-        outdoor_results = query_api.query(outdoor_query)
-        outdoor_temps = {record.values["_time"]: record.values["_value"]
-                         for table in outdoor_results
-                         for record in table.records}
+        outdoor_results = await run_query(SeriesQuery(
+            "site_metrics", range_start, range_stop, building_id=building_id,
+            fields=("outdoor_air_temp",), resolution=resolution, after=after, limit=limit))
 
         # Query indoor temperatures
-        zone_filter = f'r.zone_id == "{zone_id}"' if zone_id else 'true'
-        indoor_query = f"""
-        from(bucket: "{INFLUXDB_BUCKET}")
-          |> range(start: {range_start}, stop: {range_stop})
-          |> filter(fn: (r) => r._measurement == "thermal_zone" and {zone_filter})
-          |> filter(fn: (r) => r._field == "mean_air_temperature")
-          |> keep(columns: ["_time", "_value", "zone_id"])
-        """
-        indoor_results = query_api.query(indoor_query)
+        indoor_results = await run_query(SeriesQuery(
+            "thermal_zone", range_start, range_stop, zone_tuple(zone_ids), building_id,
+            fields=("mean_air_temperature",), resolution=resolution, after=after, limit=limit))
+
+        # Every series returned its first limit timesteps, so the first limit timesteps of them all are the page
+        page_end = None
+        if limit is not None:
+            timesteps = sorted({record.values["_time"] for results in (outdoor_results, indoor_results)
+                                for table in results for record in table.records})
+            if len(timesteps) >= limit:
+                page_end = timesteps[limit - 1]
+                set_next_cursor(request, response, encode_cursor({"t": page_end.isoformat()}))
+
+        # Outdoor readings are keyed by building, so fleet buildings do not overwrite each other
+        outdoor_temps = {}
+        for table in outdoor_results:
+            for record in table.records:
+                temperature = record.values.get("outdoor_air_temp")
+                if temperature is None or (page_end is not None and record.values["_time"] > page_end):
+                    continue
+                building_key = None if building_id else record.values.get("building_id")
+                outdoor_temps.setdefault(record.values["_time"], {})[building_key] = temperature
+        fleet = any(building_key is not None for temps in outdoor_temps.values() for building_key in temps)
 
         indoor_temps_by_time = {}
         for table in indoor_results:
             for record in table.records:
+                temperature = record.values.get("mean_air_temperature")
+                if temperature is None or (page_end is not None and record.values["_time"] > page_end):
+                    continue
                 timestamp = record.values["_time"]
                 if timestamp not in indoor_temps_by_time:
                     indoor_temps_by_time[timestamp] = {}
-                indoor_temps_by_time[timestamp][record.values.get("zone_id")] = record.values["_value"]
+                zone_key = record.values.get("zone_id")
+                if group_by:
+                    zone = ZONES.get(zone_key)
+                    zone_key = getattr(zone, group_by) if zone else "unknown"
+                if not building_id and record.values.get("building_id"):
+                    zone_key = f'{record.values["building_id"]}/{zone_key}'
+                if group_by:
+                    indoor_temps_by_time[timestamp].setdefault(zone_key, []).append(temperature)
+                else:
+                    indoor_temps_by_time[timestamp][zone_key] = temperature
+
+        if group_by:
+            for temps_by_group in indoor_temps_by_time.values():
+                for group, temps in temps_by_group.items():
+                    temps_by_group[group] = float(statistics.mean(temps))
 
         response_data = []
         all_timestamps = set(outdoor_temps.keys()).union(set(indoor_temps_by_time.keys()))
 
         for timestamp in sorted(all_timestamps):
-            outdoor_temp = outdoor_temps.get(timestamp)
+            outdoor_temp, outdoor_temp_by_building = None, None
+            if timestamp in outdoor_temps:
+                readings = outdoor_temps[timestamp]
+                outdoor_temp = readings.get(None, next(iter(readings.values())) if len(readings) == 1 else None)
+                if fleet:
+                    outdoor_temp_by_building = {building_key or "default": temperature
+                                                for building_key, temperature in readings.items()}
             indoor_data = None
 
             if timestamp in indoor_temps_by_time:
@@ -243,39 +715,77 @@ async def get_temperatures(
             response_data.append(TimestepTemperature(
                 time=timestamp,
                 outdoor_temp=outdoor_temp,
+                outdoor_temp_by_building=outdoor_temp_by_building,
                 indoor_temps=indoor_data
             ))
 
         return response_data
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.on_event("startup")
+async def start_stats_feed():
+    stats_feed.start()
+
+
+@app.on_event("shutdown")
+async def stop_stats_feed():
+    stats_feed.stop()
+
+
+@app.get("/stats/", response_model=List[ZoneStatistics])
+async def get_stats(
+        zone_id: Optional[str] = None,
+        building_id: Optional[str] = None
+):
+    """
+    Current streaming statistics of every zone (running mean/std, EWMA and quantile estimates),
+    as last published by the subscriber. No InfluxDB query is made.
+    """
+    if indexed(building_id) and zone_id is not None and zone_id not in ZONES:
+        raise HTTPException(status_code=404, detail=f"Unknown zone_id '{zone_id}'")
+    return stats_feed.get(building_id, zone_id)
+
+
+@app.get("/metrics/queries")
+async def get_query_metrics():
+    """
+    Counters of the InfluxDB query gate: executions, coalesced and shed requests, queue times.
+    """
+    return query_gate.metrics()
+
+
+@app.get("/zones/", response_model=ZoneTopology)
+async def get_zones():
+    """
+    List the building's zones grouped by block and floor.
+    """
+    return ZoneTopology(zones=list(ZONES.values()), blocks=group_zones("block"), floors=group_zones("floor"))
+
+
 @app.delete("/data/")
 async def delete_all_data():
     """
-    Delete all data from the InfluxDB bucket.
+    Delete all data from the storage backend.
     """
     try:
-        delete_api = client.delete_api()
-
-        delete_api.delete(
-            start="1970-01-01T00:00:00Z",
-            stop="2100-01-01T00:00:00Z",
-            predicate='_measurement="thermal_zone"',
-            bucket=INFLUXDB_BUCKET,
-            org=INFLUXDB_ORG
-        )
-
-        delete_api.delete(
-            start="1970-01-01T00:00:00Z",
-            stop="2100-01-01T00:00:00Z",
-            predicate='_measurement="site_metrics"',
-            bucket=INFLUXDB_BUCKET,
-            org=INFLUXDB_ORG
-        )
+        measurements = ["thermal_zone", "site_metrics"]
+        measurements += [f"{measurement}_rollup_{window}" for measurement in ("thermal_zone", "site_metrics")
+                         for _, window in ROLLUP_ROUTES]
+        backend.delete(measurements)
 
         return {"message": "All data has been deleted successfully"}
     except Exception as e:
+        # Even a partial delete invalidates the ETags issued so far
+        try:
+            backend.touch_generation()
+        except Exception as touch_error:
+            print(f"Error changing the data generation after a failed delete: {touch_error}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        generation_cache["expires"] = 0.0
+        latest_ingested_cache.clear()
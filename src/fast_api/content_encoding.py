@@ -0,0 +1,155 @@
+import gzip
+import asyncio
+from typing import Callable, Dict, Optional, Set
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def available_encoders(level: int = 6) -> Dict[str, Callable[[bytes], bytes]]:
+    """Content encoders by name, in order of preference (zstd and br only when their package is installed)"""
+    encoders = {}
+    if zstandard is not None:
+        encoders["zstd"] = zstandard.ZstdCompressor(level=min(level, 19)).compress
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=min(level, 11))
+    encoders["gzip"] = lambda body: gzip.compress(body, compresslevel=min(level, 9), mtime=0)
+    return encoders
+
+
+def negotiate(accept_encoding: str, encoders: Dict[str, Callable]) -> Optional[str]:
+    """
+    Encoding to answer an Accept-Encoding header with: the highest q-value among the available encoders,
+    ties going to the server's preference
+    :return: Encoding name, or None for an uncompressed response
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for name in encoders:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, level: int = 6):
+        """
+        Compress responses with the best encoding the client accepts (zstd, br or gzip). The response body is
+        collected before compressing it, which suits the API's JSON responses; compression runs in a worker
+        thread so large bodies do not block the event loop. A compressed response is a different representation,
+        so its strong ETag gets the encoding as a suffix ("<tag>-gzip"), removed again from If-None-Match before
+        the application compares it.
+        :param app: ASGI application
+        :param minimum_size: Bodies smaller than this many bytes are sent uncompressed
+        :param level: Compression level (capped to the maximum of each encoding)
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders = available_encoders(level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        encoding = negotiate(headers.get("accept-encoding", ""), self.encoders)
+        if encoding is None:
+            async def send_identity(message):
+                if message["type"] == "http.response.start":
+                    self.add_vary(MutableHeaders(raw=message["headers"]), message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_identity)
+            return
+
+        suffix = f'-{encoding}"'
+        stripped = set()
+        if suffix in headers.get("if-none-match", ""):
+            scope = dict(scope, headers=strip_etag_suffix(scope["headers"], suffix, stripped))
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self.send_response(send, start, b"".join(chunks), encoding, stripped)
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def add_vary(headers: MutableHeaders, status: int) -> bool:
+        """Mark a response as depending on Accept-Encoding, unless it has no body or is already encoded"""
+        if status == 204 or "content-encoding" in headers:
+            return False
+        headers.add_vary_header("Accept-Encoding")
+        return True
+
+    async def send_response(self, send, start, body: bytes, encoding: str, stripped: Set[str]):
+        """
+        Send a collected response, compressed if large enough
+        :param stripped: ETags of If-None-Match that carried the suffix of the encoding, for the 304 responses
+        """
+        headers = MutableHeaders(raw=start["headers"])
+        etag = headers.get("etag")
+        if self.add_vary(headers, start["status"]):
+            if start["status"] == 304:
+                if etag in stripped:
+                    headers["ETag"] = etag[:-1] + f'-{encoding}"'
+            elif len(body) >= self.minimum_size:
+                body = await asyncio.to_thread(self.encoders[encoding], body)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = etag[:-1] + f'-{encoding}"'
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
+
+
+def strip_etag_suffix(raw_headers, suffix: str, stripped: Set[str]):
+    """
+    Request headers with the encoding suffix removed from the ETags of If-None-Match
+    :param suffix: Suffix closing the ETags of the negotiated encoding, e.g. '-gzip"'
+    :param stripped: Filled with the ETags that carried the suffix, once removed
+    """
+    result = []
+    for name, value in raw_headers:
+        if name.lower() == b"if-none-match":
+            tags = []
+            for tag in value.decode("latin-1").split(","):
+                tag = tag.strip()
+                if tag.endswith(suffix):
+                    tag = tag[:-len(suffix)] + '"'
+                    stripped.add(tag.removeprefix("W/"))
+                tags.append(tag)
+            value = ", ".join(tags).encode("latin-1")
+        result.append((name, value))
+    return result
@@ -0,0 +1,119 @@
+import time
+import asyncio
+from typing import Any, Callable, Dict, Hashable
+
+
+class QueryShed(Exception):
+    """Raised when the query queue is too deep to accept another query"""
+
+
+class _Execution:
+    __slots__ = ("task", "waiters", "started")
+
+    def __init__(self):
+        """One query execution shared by the callers waiting for it"""
+        self.task = None
+        self.waiters = 0
+        self.started = False
+
+
+class QueryGate:
+    def __init__(self, max_concurrency: int, max_queue: int):
+        """
+        Collapse identical in-flight queries into one execution and cap the concurrent queries
+        :param max_concurrency: Queries executed against the database at the same time
+        :param max_queue: Queries allowed to wait for a slot before new ones are shed
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.inflight: Dict[Hashable, _Execution] = {}
+        self.queued = 0
+        self.running = 0
+
+        self.dispatched = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.failed = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    async def run(self, key: Hashable, execute: Callable[[], Any]) -> Any:
+        """
+        Run a blocking query in a worker thread, or join the identical query already in flight.
+        The execution is a task of its own that every caller awaits through a shield, so a caller being
+        cancelled (e.g. its client disconnected) never cancels the query for the others. A query still waiting
+        for a slot is abandoned once no caller waits for it; a running one completes, as its thread cannot stop.
+        :param key: Identity of the query (e.g. a SeriesQuery); equal keys share one execution
+        :param execute: Blocking callable performing the query
+        """
+        execution = self.inflight.get(key)
+        if execution is not None:
+            self.coalesced += 1
+        else:
+            if self.queued >= self.max_queue:
+                self.shed += 1
+                raise QueryShed(f"{self.queued} queries already waiting for one of {self.max_concurrency} slots")
+            self.queued += 1
+            execution = _Execution()
+            execution.task = asyncio.ensure_future(self.execute(execution, execute))
+            execution.task.add_done_callback(lambda task: self.finished(key, execution))
+            self.inflight[key] = execution
+
+        execution.waiters += 1
+        try:
+            return await asyncio.shield(execution.task)
+        finally:
+            execution.waiters -= 1
+            if not execution.waiters and not execution.started and not execution.task.done():
+                # Nobody waits for this query any more and it did not reach the database yet
+                if self.inflight.get(key) is execution:
+                    del self.inflight[key]
+                execution.task.cancel()
+
+    async def execute(self, execution: _Execution, execute: Callable[[], Any]) -> Any:
+        """Wait for a slot, then run the query in a worker thread (queued was counted by the caller)"""
+        enqueued_at = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        queue_time = time.perf_counter() - enqueued_at
+        self.dispatched += 1
+        self.queue_time_total += queue_time
+        self.queue_time_max = max(self.queue_time_max, queue_time)
+
+        execution.started = True
+        self.running += 1
+        try:
+            result = await asyncio.to_thread(execute)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+        self.executed += 1
+        return result
+
+    def finished(self, key: Hashable, execution: _Execution):
+        if self.inflight.get(key) is execution:
+            del self.inflight[key]
+        # Mark the outcome retrieved, so a failed query whose callers are gone does not log a warning
+        if not execution.task.cancelled():
+            execution.task.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "shed": self.shed,
+            "failed": self.failed,
+            "queue_time_mean": self.queue_time_total / self.dispatched if self.dispatched else 0.0,
+            "queue_time_max": self.queue_time_max
+        }
@@ -0,0 +1,86 @@
+import heapq
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+from storage import record_key
+
+
+def plan_time_shards(start: datetime, stop: datetime,
+                     shard_span: Optional[timedelta]) -> List[Tuple[datetime, datetime]]:
+    """
+    Split [start, stop) into consecutive shards of at most shard_span
+    :param shard_span: Span of one shard (None or zero keeps the range whole)
+    """
+    if not shard_span or shard_span <= timedelta(0):
+        return [(start, stop)]
+
+    shards = []
+    while start < stop:
+        shard_stop = min(start + shard_span, stop)
+        shards.append((start, shard_stop))
+        start = shard_stop
+    return shards
+
+
+def plan_zone_shards(zone_ids: Optional[List[str]], zone_shards: int) -> List[Optional[List[str]]]:
+    """
+    Split the selected zones into at most zone_shards groups (None selects every zone and is not split)
+    """
+    if zone_ids is None or zone_shards <= 1 or len(zone_ids) <= 1:
+        return [zone_ids]
+    count = min(zone_shards, len(zone_ids))
+    return [zone_ids[i::count] for i in range(count)]
+
+
+def merge_tables(tables) -> Iterator[Any]:
+    """Merge the time-ordered records of query tables (one table per series) into one time-ordered stream"""
+    return heapq.merge(*(table.records for table in tables), key=record_key)
+
+
+class RangeSplitter:
+    def __init__(self, run_query: Callable[[Any], Awaitable[Any]], parallelism: int):
+        """
+        Run a query as time shards (and optionally zone shards) concurrently, yielding the merged records
+        in time order as the shards before them complete
+        :param run_query: Coroutine function executing a query and returning its tables
+        :param parallelism: Shard queries in flight at once; keep it below the query gate's concurrency so one
+                            request cannot take every slot or fill the query queue
+        """
+        self.run_query = run_query
+        self.parallelism = max(1, parallelism)
+
+    async def records(self, build_query: Callable[[Optional[datetime], Optional[datetime], Optional[List[str]]], Any],
+                      time_shards: List[Tuple[Optional[datetime], Optional[datetime]]],
+                      zone_groups: List[Optional[List[str]]]) -> AsyncIterator[Any]:
+        """
+        :param build_query: Builds the query of one shard from (start, stop, zone_ids), None being an open end
+        :param time_shards: Consecutive [start, stop) ranges, see plan_time_shards(); a single unsplit range
+                            may have open ends (None)
+        :param zone_groups: Zone selections queried separately for every time shard, see plan_zone_shards()
+        """
+        # Queries in time shard order, the zone groups of a shard next to each other
+        queries = [build_query(start, stop, zone_ids) for start, stop in time_shards for zone_ids in zone_groups]
+        in_flight = deque()
+        next_query = 0
+        try:
+            tables = []
+            while next_query < len(queries) or in_flight:
+                # Keep up to parallelism queries running ahead of the one being consumed
+                while next_query < len(queries) and len(in_flight) < self.parallelism:
+                    in_flight.append(asyncio.ensure_future(self.run_query(queries[next_query])))
+                    next_query += 1
+
+                tables.extend(await in_flight[0])
+                in_flight.popleft()
+                if (next_query - len(in_flight)) % len(zone_groups) == 0:
+                    # Every zone group of the time shard is in: time shards do not overlap, so concatenating the
+                    # merged shards keeps the stream ordered
+                    for record in merge_tables(tables):
+                        yield record
+                    tables = []
+        finally:
+            # The consumer stopped early (e.g. its client disconnected): stop waiting for the queries read ahead.
+            # Only this request's wait is cancelled; the query gate keeps executions other requests share.
+            for task in in_flight:
+                task.cancel()
@@ -0,0 +1,62 @@
+import json
+import threading
+import paho.mqtt.client as mqtt
+
+STATS_TOPICS = ["building/stats/#", "building/+/stats/#"]
+
+
+class StatsFeed:
+    def __init__(self, broker_address, broker_port=1883, topics=None):
+        """
+        Keep the latest retained zone statistics published by the subscriber, so the API serves them
+        without querying InfluxDB
+        :param broker_address: IP address or hostname of MQTT broker
+        :param broker_port: Port of MQTT broker
+        :param topics: Statistics topics to subscribe to
+        """
+        self.broker_address = broker_address
+        self.broker_port = broker_port
+        self.topics = topics or STATS_TOPICS
+        self.client = None
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            for topic in self.topics:
+                client.subscribe(topic)
+        else:
+            print(f"Statistics feed connection failed with result code {rc}")
+
+    def on_message(self, client, userdata, message):
+        try:
+            snapshot = json.loads(message.payload.decode("utf-8"))
+        except json.JSONDecodeError as e:
+            print(f"Error decoding statistics snapshot: {e}")
+            return
+        with self.lock:
+            self.snapshots[(snapshot.get("building_id"), snapshot["zone_id"])] = snapshot
+
+    def start(self):
+        """Connect in the background; the broker replays the retained snapshots on subscribe"""
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        try:
+            self.client.connect_async(self.broker_address, port=self.broker_port)
+            self.client.loop_start()
+        except Exception as e:
+            print(f"Statistics feed connection error: {e}")
+
+    def stop(self):
+        if self.client:
+            self.client.disconnect()
+            self.client.loop_stop()
+
+    def get(self, building_id=None, zone_id=None):
+        """Latest snapshots, optionally filtered by building and zone"""
+        with self.lock:
+            return [snapshot for (snapshot_building, snapshot_zone), snapshot in sorted(
+                        self.snapshots.items(), key=lambda item: (item[0][0] or "", item[0][1]))
+                    if (building_id is None or snapshot_building == building_id)
+                    and (zone_id is None or snapshot_zone == zone_id)]
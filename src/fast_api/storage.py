@@ -0,0 +1,665 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import numpy as np
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Fields returned by a query without a field selection
+MEASUREMENT_FIELDS = {
+    "thermal_zone": ["mean_air_temperature", "operative_temperature", "air_relative_humidity",
+                     "air_co2_concentration", "infiltration_air_change_rate", "mech_ventilation_air_changes",
+                     "internal_latent_gain", "cooling_rate", "heating_rate", "people_sensible_heat",
+                     "thermal_comfort_pmv", "thermal_comfort_ppd"],
+    "site_metrics": ["interior_lights_electricity", "facility_electricity", "outdoor_air_temp",
+                     "diffuse_solar_radiation", "direct_solar_radiation"],
+}
+TAG_COLUMNS = ["zone_id", "building_id"]
+# Marker of the stored data, changed whenever points may have changed in a range already served (see
+# new_generation()): a new series, a point written at or before the latest one of its series, or a delete
+GENERATION_MEASUREMENT = "data_generation"
+
+
+@dataclass(frozen=True)
+class SeriesQuery:
+    """
+    Points of a measurement in [start, stop), returned as one time-ordered table per series with the fields as
+    columns. Hashable, so identical queries can share one execution.
+    A page starts after the keyset position `after`, a prefix of (time, building_id, zone_id) (see record_key),
+    and holds at most `limit` points of every series: the first `limit` points of the merged tables are the page.
+    """
+    measurement: str
+    start: Optional[datetime] = None
+    stop: Optional[datetime] = None
+    zone_ids: Optional[Tuple[str, ...]] = None
+    building_id: Optional[str] = None
+    fields: Optional[Tuple[str, ...]] = None
+    resolution: str = "raw"
+    after: Optional[tuple] = None
+    limit: Optional[int] = None
+
+    @property
+    def source(self) -> str:
+        """Measurement holding the data of the resolution ('raw', or a rollup window such as '1h')"""
+        return self.measurement if self.resolution == "raw" else f"{self.measurement}_rollup_{self.resolution}"
+
+    def columns(self) -> List[str]:
+        return list(self.fields) if self.fields else MEASUREMENT_FIELDS.get(self.measurement, [])
+
+    def stored_name(self, field: str) -> str:
+        """Name of a field in the source (rollups store its mean as <field>_mean)"""
+        return field if self.resolution == "raw" else f"{field}_mean"
+
+    @property
+    def range_start(self) -> Optional[datetime]:
+        """Start of the range to read, moved up to the time of the keyset position"""
+        if self.after is None or (self.start is not None and to_datetime(self.start) > to_datetime(self.after[0])):
+            return self.start
+        return self.after[0]
+
+
+def record_key(record) -> tuple:
+    """Order of the records of a query: time, then building and zone"""
+    return record.values["_time"], record.values.get("building_id") or "", record.values.get("zone_id") or ""
+
+
+def page_records(records: List[Any], query: SeriesQuery) -> List[Any]:
+    """Time-ordered records of one series after the query's keyset position, cut to its limit"""
+    if query.after is not None:
+        after = (to_datetime(query.after[0]),) + tuple(query.after[1:])
+        records = [record for record in records if record_key(record)[:len(after)] > after]
+    return records[:query.limit] if query.limit is not None else records
+
+
+def new_generation() -> str:
+    """A data generation marker unique across processes"""
+    return f"{time.time_ns()}-{os.getpid()}"
+
+
+class Record:
+    __slots__ = ("values",)
+
+    def __init__(self, values: Dict[str, Any]):
+        self.values = values
+
+
+class Table:
+    __slots__ = ("records",)
+
+    def __init__(self, records: List[Record]):
+        self.records = records
+
+
+def to_datetime(value) -> datetime:
+    """Parse an ISO time (e.g. '2005-01-01T00:10:00Z'), reading naive times as UTC"""
+    if isinstance(value, str):
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def to_ns(value) -> int:
+    dt = to_datetime(value)
+    return int(dt.timestamp()) * 1_000_000_000 + dt.microsecond * 1000
+
+
+def flux_time(dt: Optional[datetime], default: str) -> str:
+    if dt is None:
+        return default
+    return to_datetime(dt).isoformat().replace('+00:00', 'Z')
+
+
+def flux_string(value: str) -> str:
+    """Quote a value as a Flux string literal"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class InfluxBackend:
+    def __init__(self, url: str, token: str, org: str, bucket: str, timeout: int = 30_000):
+        """
+        Store the points in InfluxDB and query them with Flux
+        :param url: URL of the InfluxDB server
+        :param token: API token
+        :param org: Organization
+        :param bucket: Bucket of the points
+        :param timeout: HTTP timeout in milliseconds
+        """
+        self.client = InfluxDBClient(url=url, token=token, org=org, timeout=timeout)
+        self.org = org
+        self.bucket = bucket
+        self.write_api = None
+        # Time of the latest point written by this process to every series, to detect rewrites
+        self.latest = {}
+
+    @staticmethod
+    def filters(query: SeriesQuery) -> str:
+        """Flux predicate on measurement and tags, pushed down to the storage engine"""
+        predicate = f'r._measurement == {flux_string(query.source)}'
+        if query.zone_ids is not None:
+            zones = " or ".join(f'r.zone_id == {flux_string(zone_id)}' for zone_id in query.zone_ids)
+            predicate += f" and ({zones})" if zones else " and false"
+        if query.building_id:
+            predicate += f' and r.building_id == {flux_string(query.building_id)}'
+        return predicate
+
+    def flux(self, query: SeriesQuery) -> str:
+        steps = ""
+        if query.fields:
+            fields = " or ".join(f'r._field == {flux_string(query.stored_name(field))}' for field in query.fields)
+            steps += f"\n      |> filter(fn: (r) => {fields})"
+        if query.resolution != "raw":
+            steps += """
+      |> filter(fn: (r) => strings.hasSuffix(v: r._field, suffix: "_mean"))
+      |> map(fn: (r) => ({r with _field: strings.trimSuffix(v: r._field, suffix: "_mean")}))"""
+        if query.limit is not None:
+            # Every point carries all its fields, so limiting each field's table before the pivot limits the
+            # series; the point at the keyset time may still be skipped afterwards, hence one more
+            steps += f"\n      |> limit(n: {query.limit + (1 if query.after is not None else 0)})"
+        columns = ", ".join(flux_string(column) for column in ["_time"] + TAG_COLUMNS + query.columns())
+        return f"""
+    import "strings"
+    from(bucket: "{self.bucket}")
+      |> range(start: {flux_time(query.range_start, "0")}, stop: {flux_time(query.stop, "now()")})
+      |> filter(fn: (r) => {self.filters(query)}){steps}
+      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+      |> keep(columns: [{columns}])
+    """
+
+    def query(self, query: SeriesQuery):
+        tables = self.client.query_api().query(self.flux(query))
+        if query.after is not None or query.limit is not None:
+            for table in tables:
+                table.records = page_records(table.records, query)
+        return tables
+
+    def bounds(self, query: SeriesQuery) -> Optional[Tuple[datetime, datetime]]:
+        """Time of the first and last point matching a query, using the first()/last() pushdowns"""
+        flux = f"""
+    data = from(bucket: "{self.bucket}")
+      |> range(start: {flux_time(query.start, "0")}, stop: {flux_time(query.stop, "now()")})
+      |> filter(fn: (r) => {self.filters(query)})
+    union(tables: [data |> first(), data |> last()])
+      |> keep(columns: ["_time"])
+    """
+        times = [record.values["_time"] for table in self.client.query_api().query(flux) for record in table.records]
+        return (min(times), max(times)) if times else None
+
+    def latest_by_building(self, query: SeriesQuery) -> Dict[Optional[str], datetime]:
+        """Time of the last point of each building matching a query (None for points without a building_id)"""
+        flux = f"""
+    from(bucket: "{self.bucket}")
+      |> range(start: {flux_time(query.start, "0")}, stop: {flux_time(query.stop, "now()")})
+      |> filter(fn: (r) => {self.filters(query)})
+      |> last()
+      |> keep(columns: ["_time", "building_id"])
+    """
+        latest = {}
+        for table in self.client.query_api().query(flux):
+            for record in table.records:
+                building_id = record.values.get("building_id")
+                latest[building_id] = max(latest.get(building_id, record.values["_time"]), record.values["_time"])
+        return latest
+
+    def delete(self, measurements: List[str]):
+        delete_api = self.client.delete_api()
+        for measurement in measurements:
+            delete_api.delete(
+                start="1970-01-01T00:00:00Z",
+                stop="2100-01-01T00:00:00Z",
+                predicate=f'_measurement="{measurement}"',
+                bucket=self.bucket,
+                org=self.org
+            )
+        self.touch_generation()
+
+    def ping(self) -> bool:
+        return self.client.ping()
+
+    def generation(self) -> Optional[str]:
+        """Current data generation marker (None until data was first written or deleted)"""
+        flux = f"""
+    from(bucket: "{self.bucket}")
+      |> range(start: 0)
+      |> filter(fn: (r) => r._measurement == {flux_string(GENERATION_MEASUREMENT)})
+      |> last()
+    """
+        markers = [record.values["_value"] for table in self.client.query_api().query(flux) for record in table.records]
+        return markers[-1] if markers else None
+
+    def touch_generation(self):
+        if self.write_api is None:
+            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        point = Point(GENERATION_MEASUREMENT).field("marker", new_generation()).time(time.time_ns(), WritePrecision.NS)
+        self.write_api.write(bucket=self.bucket, record=point)
+
+    def write(self, measurement: str, tags: Dict[str, str], timestamp, fields: Dict[str, float]):
+        self.write_many([{"measurement": measurement, "tags": tags, "time": timestamp, "fields": fields}])
+
+    def write_many(self, records: List[Dict[str, Any]]):
+        """Write records (dicts with measurement, tags, time and fields) in one request"""
+        if self.write_api is None:
+            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        points = []
+        latest = {}
+        rewrites = False
+        for record in records:
+            point = Point(record["measurement"]).time(record["time"], WritePrecision.NS)
+            for tag, value in record["tags"].items():
+                point.tag(tag, value)
+            for field, value in record["fields"].items():
+                point.field(field, value)
+            points.append(point)
+
+            key = (record["measurement"], tuple(sorted(record["tags"].items())))
+            timestamp_ns = to_ns(record["time"])
+            previous = latest.get(key, self.latest.get(key))
+            rewrites = rewrites or previous is None or timestamp_ns <= previous
+            latest[key] = timestamp_ns if previous is None else max(previous, timestamp_ns)
+        self.write_api.write(bucket=self.bucket, record=points)
+        self.latest.update(latest)
+        if rewrites:
+            self.touch_generation()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.write_api is not None:
+            self.write_api.close()
+        self.client.close()
+
+
+def _read_column(path: str, dtype, rows: Optional[int] = None) -> np.ndarray:
+    """Memory-map a column file, or its first rows (padding a missing or shorter column with NaN)"""
+    size = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+    if rows is not None:
+        size = min(size, rows)
+    column = np.memmap(path, dtype=dtype, mode="r", shape=(size,)) if size else np.empty(0, dtype)
+    if rows is not None and size < rows:
+        column = np.concatenate([column, np.full(rows - size, np.nan)])
+    return column
+
+
+def _to_datetimes(times: np.ndarray) -> List[datetime]:
+    """UTC datetimes of nanosecond timestamps (at microsecond precision, like the InfluxDB client)"""
+    moments = times.astype("datetime64[ns]").astype("datetime64[us]").tolist()
+    return [moment.replace(tzinfo=timezone.utc) for moment in moments]
+
+
+class _SeriesWriter:
+    def __init__(self, path: str, tags: Dict[str, str], segment_rows: int):
+        """
+        Append-only writer of one series: a directory of fixed-size segments, one file per column. Writers of
+        several processes (a subscriber group) may share a series; they flush under a lock on the series.
+        """
+        self.path = path
+        self.tags = tags
+        self.segment_rows = segment_rows
+        self.times = []
+        self.values = {}
+        self.open()
+
+    def open(self):
+        """Create the series if needed and resume after the last segment on disk"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "tags.json"), "w") as f:
+            json.dump(self.tags, f)
+        self.resume()
+
+    def resume(self):
+        """Read the index, last segment and its rows back from disk, where other writers may have appended"""
+        self.index = ColumnarStore.read_index(self.path)
+        segments = sorted(int(name) for name in os.listdir(self.path) if name.isdigit())
+        self.segment = segments[-1] if segments else 0
+        self.rows = self.segment_rows_on_disk()
+        if self.rows >= self.segment_rows:
+            # Filled by a flush interrupted before sealing it
+            self.seal()
+
+    @contextmanager
+    def locked(self):
+        """Hold the series lock, shared with the writers of other processes (a no-op without fcntl)"""
+        with open(os.path.join(self.path, ".lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def segment_path(self, name: str = "") -> str:
+        return os.path.join(self.path, f"{self.segment:06d}", name)
+
+    def latest_on_disk(self) -> Optional[int]:
+        """Time of the latest point written to the series (None for an empty series)"""
+        latest = max((bounds["max"] for bounds in self.index.values()), default=None)
+        if self.rows:
+            segment_latest = int(_read_column(self.segment_path("_time.i8"), np.int64, self.rows).max())
+            latest = segment_latest if latest is None else max(latest, segment_latest)
+        return latest
+
+    def segment_rows_on_disk(self) -> int:
+        path = self.segment_path("_time.i8")
+        return min(os.path.getsize(path) // 8, self.segment_rows) if os.path.exists(path) else 0
+
+    def append(self, timestamp_ns: int, fields: Dict[str, float]):
+        row = len(self.times)
+        self.times.append(timestamp_ns)
+        for field, value in fields.items():
+            column = self.values.get(field)
+            if column is None:
+                column = self.values[field] = [np.nan] * row
+            column.append(float(value))
+        for column in self.values.values():
+            if len(column) <= row:
+                column.append(np.nan)
+
+    def flush(self) -> bool:
+        """
+        Write the buffered points; points not written (the disk failed) stay buffered for the next flush
+        :return: Whether the points started the series or were not all later than its latest point
+        """
+        if not self.times:
+            return False
+        if not os.path.isdir(self.path):
+            # The series was deleted: start over
+            self.open()
+
+        times = np.array(self.times, dtype=np.int64)
+        values = {field: np.array(column, dtype=np.float64) for field, column in self.values.items()}
+        written = 0
+        try:
+            with self.locked():
+                self.resume()
+                latest = self.latest_on_disk()
+                rewrites = latest is None or int(times.min()) <= latest
+                while written < len(times):
+                    count = min(len(times) - written, self.segment_rows - self.rows)
+                    self.write_segment(times[written:written + count],
+                                       {field: column[written:written + count] for field, column in values.items()})
+                    written += count
+        finally:
+            self.times = self.times[written:]
+            self.values = {field: column[written:] for field, column in self.values.items()}
+        return rewrites
+
+    def write_segment(self, times: np.ndarray, values: Dict[str, np.ndarray]):
+        """Append points to the current segment, sealing it once full"""
+        os.makedirs(self.segment_path(), exist_ok=True)
+        # Fields first: readers only see the rows of the time column
+        for field, column in values.items():
+            self.append_column(self.segment_path(f"{field}.f8"), column)
+        self.append_column(self.segment_path("_time.i8"), times)
+        self.rows += len(times)
+
+        if self.rows == self.segment_rows:
+            self.seal()
+
+    def append_column(self, path: str, column: np.ndarray):
+        """
+        Append to a column file after the current rows of the segment: what an interrupted flush left past them
+        is cut off, and a field missing from earlier points is padded with NaN
+        """
+        with open(path, "ab") as f:
+            end = f.seek(0, os.SEEK_END)
+            size = min(end // column.itemsize, self.rows)
+            if end != size * column.itemsize:
+                f.truncate(size * column.itemsize)
+            if size < self.rows:
+                f.write(np.full(self.rows - size, np.nan).tobytes())
+            f.write(column.tobytes())
+
+    def seal(self):
+        """Record the time range of the full segment in the series index and start the next one"""
+        segment_times = np.fromfile(self.segment_path("_time.i8"), dtype=np.int64, count=self.segment_rows)
+        self.index[str(self.segment)] = {
+            "min": int(segment_times.min()),
+            "max": int(segment_times.max()),
+            "sorted": bool(np.all(segment_times[1:] > segment_times[:-1]))
+        }
+        with open(os.path.join(self.path, "index.json.tmp"), "w") as f:
+            json.dump(self.index, f)
+        os.replace(os.path.join(self.path, "index.json.tmp"), os.path.join(self.path, "index.json"))
+        self.segment += 1
+        self.rows = 0
+
+
+class ColumnarStore:
+    def __init__(self, root: str, segment_rows: int = 65536, flush_interval: float = 1.0):
+        """
+        Embedded columnar store: <root>/<measurement>/<series>/<segment>/<column>, where a series is one set of
+        tags, a segment holds up to segment_rows points and every column (the time index and each field) is an
+        append-only array file, memory-mapped when read. Full segments are sealed with their time range in the
+        series index, so range queries skip them without reading. A point written again with the same time
+        replaces the fields it carries, like in InfluxDB.
+        :param root: Directory of the store
+        :param segment_rows: Points per segment
+        :param flush_interval: Seconds between two flushes of the buffered points to disk
+        """
+        self.root = str(root)
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self.writers = {}
+        self.flush_timer = None
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def series_name(tags: Dict[str, str]) -> str:
+        return hashlib.sha1(json.dumps(sorted(tags.items())).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def read_index(path: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(os.path.join(path, "index.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    # Writes
+
+    def ping(self) -> bool:
+        return os.path.isdir(self.root)
+
+    def generation(self) -> Optional[str]:
+        """Current data generation marker (None until data was first written or deleted)"""
+        try:
+            with open(os.path.join(self.root, GENERATION_MEASUREMENT)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def touch_generation(self):
+        path = os.path.join(self.root, GENERATION_MEASUREMENT)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            f.write(new_generation())
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def write(self, measurement: str, tags: Dict[str, str], timestamp, fields: Dict[str, float]):
+        """Buffer a point; buffered points reach the disk (and the readers) within flush_interval"""
+        with self.lock:
+            key = (measurement, tuple(sorted(tags.items())))
+            writer = self.writers.get(key)
+            if writer is None:
+                path = os.path.join(self.root, measurement, self.series_name(tags))
+                writer = self.writers[key] = _SeriesWriter(path, dict(tags), self.segment_rows)
+            writer.append(to_ns(timestamp), fields)
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def write_many(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self.write(record["measurement"], record["tags"], record["time"], record["fields"])
+
+    def flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            rewrites = False
+            for writer in self.writers.values():
+                try:
+                    rewrites = writer.flush() or rewrites
+                except OSError as e:
+                    print(f"Error flushing series {writer.path}, its points stay buffered: {e}")
+            if rewrites:
+                self.touch_generation()
+
+    def close(self):
+        self.flush()
+
+    # Reads
+
+    def series(self, query: SeriesQuery) -> List[Tuple[str, Dict[str, str]]]:
+        """Directories and tags of the series of a query's source matching its tag filters"""
+        directory = os.path.join(self.root, query.source)
+        if not os.path.isdir(directory):
+            return []
+        zone_ids = set(query.zone_ids) if query.zone_ids is not None else None
+        matches = []
+        for name in sorted(os.listdir(directory)):
+            try:
+                with open(os.path.join(directory, name, "tags.json")) as f:
+                    tags = json.load(f)
+            except FileNotFoundError:
+                continue
+            if zone_ids is not None and tags.get("zone_id") not in zone_ids:
+                continue
+            if query.building_id and tags.get("building_id") != query.building_id:
+                continue
+            matches.append((os.path.join(directory, name), tags))
+        return matches
+
+    def read_series(self, path: str, columns: List[str], start_ns: int, stop_ns: int):
+        """
+        Points of a series in [start_ns, stop_ns), sorted by time with rewritten points merged field by field
+        :return: (times, {column: values})
+        """
+        index = self.read_index(path)
+        times, values = [], {column: [] for column in columns}
+        for segment in sorted(name for name in os.listdir(path) if name.isdigit()):
+            bounds = index.get(str(int(segment)))
+            if bounds and (bounds["max"] < start_ns or bounds["min"] >= stop_ns):
+                continue
+            segment_path = os.path.join(path, segment)
+            segment_times = _read_column(os.path.join(segment_path, "_time.i8"), np.int64)
+            if bounds and bounds["sorted"]:
+                selected = slice(*np.searchsorted(segment_times, [start_ns, stop_ns]))
+            else:
+                selected = np.flatnonzero((segment_times >= start_ns) & (segment_times < stop_ns))
+            selected_times = segment_times[selected]
+            if not len(selected_times):
+                continue
+            times.append(np.array(selected_times))
+            for column in columns:
+                values[column].append(np.array(_read_column(
+                    os.path.join(segment_path, f"{column}.f8"), np.float64, len(segment_times))[selected]))
+
+        if not times:
+            return np.empty(0, np.int64), {column: np.empty(0) for column in columns}
+        times = np.concatenate(times)
+        values = {column: np.concatenate(arrays) for column, arrays in values.items()}
+        if len(times) > 1 and not np.all(times[1:] > times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+            # Keep the last write of every field of a timestamp, like InfluxDB: a rewrite without a field (NaN)
+            # leaves its earlier value
+            last = np.append(times[1:] != times[:-1], True)
+            first = np.flatnonzero(np.insert(last[:-1], 0, True))
+            times = times[last]
+            positions = np.arange(len(order))
+            for column, array in values.items():
+                array = array[order]
+                latest = np.maximum.accumulate(np.where(np.isnan(array), -1, positions))[last]
+                values[column] = np.where(latest >= first, array[np.maximum(latest, 0)], np.nan)
+        return times, values
+
+    def query(self, query: SeriesQuery) -> List[Table]:
+        start_ns = to_ns(query.range_start) if query.range_start is not None else np.iinfo(np.int64).min
+        stop_ns = to_ns(query.stop) if query.stop is not None else np.iinfo(np.int64).max
+        columns = query.columns()
+        tables = []
+        for path, tags in self.series(query):
+            times, values = self.read_series(path, [query.stored_name(column) for column in columns],
+                                             start_ns, stop_ns)
+            if query.after is not None and len(times) and times[0] == to_ns(query.after[0]):
+                # The point at the keyset time belongs to the page if its series sorts after the position
+                series_key = (tags.get("building_id") or "", tags.get("zone_id") or "")
+                if series_key[:len(query.after) - 1] <= tuple(query.after[1:]):
+                    times, values = times[1:], {column: array[1:] for column, array in values.items()}
+            if query.limit is not None:
+                times, values = times[:query.limit], {column: array[:query.limit] for column, array in values.items()}
+            if not len(times):
+                continue
+            instants = _to_datetimes(times)
+            # NaN marks a field missing from a point
+            column_values = [[None if value != value else value
+                              for value in values[query.stored_name(column)].tolist()] for column in columns]
+            tag_values = {tag: tags[tag] for tag in TAG_COLUMNS if tag in tags}
+            tables.append(Table([Record(dict(tag_values, _time=instant, **dict(zip(columns, row))))
+                                 for instant, *row in zip(instants, *column_values)]))
+        return tables
+
+    def bounds(self, query: SeriesQuery) -> Optional[Tuple[datetime, datetime]]:
+        """Time of the first and last point matching a query"""
+        start_ns = to_ns(query.start) if query.start is not None else np.iinfo(np.int64).min
+        stop_ns = to_ns(query.stop) if query.stop is not None else np.iinfo(np.int64).max
+        first, last = None, None
+        for path, _ in self.series(query):
+            times, _ = self.read_series(path, [], start_ns, stop_ns)
+            if len(times):
+                first = times[0] if first is None else min(first, times[0])
+                last = times[-1] if last is None else max(last, times[-1])
+        if first is None:
+            return None
+        first, last = _to_datetimes(np.array([first, last]))
+        return first, last
+
+    def latest_by_building(self, query: SeriesQuery) -> Dict[Optional[str], datetime]:
+        """Time of the last point of each building matching a query (None for points without a building_id)"""
+        start_ns = to_ns(query.start) if query.start is not None else np.iinfo(np.int64).min
+        stop_ns = to_ns(query.stop) if query.stop is not None else np.iinfo(np.int64).max
+        latest = {}
+        for path, tags in self.series(query):
+            times, _ = self.read_series(path, [], start_ns, stop_ns)
+            if len(times):
+                building_id = tags.get("building_id")
+                latest[building_id] = max(latest.get(building_id, times[-1]), times[-1])
+        buildings = list(latest)
+        return dict(zip(buildings, _to_datetimes(np.array([latest[building_id] for building_id in buildings],
+                                                          dtype=np.int64))))
+
+    def delete(self, measurements: List[str]):
+        for measurement in measurements:
+            shutil.rmtree(os.path.join(self.root, measurement), ignore_errors=True)
+        self.touch_generation()
+
+
+def open_backend(name: str, **options):
+    """
+    Open a storage backend by name
+    :param name: 'influx' (options: url, token, org, bucket) or 'columnar' (options: root, segment_rows)
+    """
+    if name == "influx":
+        return InfluxBackend(**options)
+    if name == "columnar":
+        return ColumnarStore(**options)
+    raise ValueError(f"Unknown storage backend '{name}', expected 'influx' or 'columnar'")
@@ -0,0 +1,128 @@
+import os
+import time
+import argparse
+from typing import Optional
+from dataclasses import dataclass
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.constants import FILTERED_DATA_CSV, MQTT_BROKER, MQTT_PORT, IDF_PATH
+from src.publisher import PublishMetrics
+
+
+@dataclass
+class BuildingSpec:
+    """Replay of one building of the fleet"""
+    building_id: str
+    csv_path: str = str(FILTERED_DATA_CSV)
+    idf_path: str = str(IDF_PATH)
+    time_offset_minutes: int = 0
+    noise_std: float = 0.0
+    seed: Optional[int] = None
+
+
+def perturbed_fleet(count, csv_path=FILTERED_DATA_CSV, offset_step_minutes=0, noise_std=0.01, prefix="bldg"):
+    """
+    Build a fleet of copies of one simulation output, each shifted in time and perturbed with noise
+    :param count: Number of buildings
+    :param csv_path: Filtered EnergyPlus output every copy is derived from
+    :param offset_step_minutes: Time offset between two consecutive buildings
+    :param noise_std: Relative standard deviation of the noise applied to every value
+    :param prefix: Prefix of the generated building IDs
+    """
+    return [
+        BuildingSpec(
+            building_id=f"{prefix}-{index:04d}",
+            csv_path=str(csv_path),
+            time_offset_minutes=index * offset_step_minutes,
+            noise_std=noise_std,
+            seed=index
+        )
+        for index in range(count)
+    ]
+
+
+def csv_fleet(csv_paths, idf_paths=None, prefix="bldg"):
+    """
+    Build a fleet with one building per filtered EnergyPlus output
+    :param csv_paths: Filtered EnergyPlus outputs
+    :param idf_paths: IDF each output was simulated from (default: the sample IDF for all)
+    :param prefix: Prefix of the generated building IDs
+    """
+    idf_paths = idf_paths or [IDF_PATH] * len(csv_paths)
+    return [BuildingSpec(building_id=f"{prefix}-{index:04d}", csv_path=str(path), idf_path=str(idf_path))
+            for index, (path, idf_path) in enumerate(zip(csv_paths, idf_paths))]
+
+
+def run_building(spec, mqtt_broker=MQTT_BROKER, mqtt_port=MQTT_PORT, publish_interval=0):
+    """
+    Replay one building in the current process
+    :return: (building_id, published messages, elapsed seconds)
+    """
+    start = time.perf_counter()
+    processor = PublishMetrics(
+        spec.csv_path,
+        mqtt_broker,
+        mqtt_port,
+        building_id=spec.building_id,
+        time_offset=timedelta(minutes=spec.time_offset_minutes),
+        noise_std=spec.noise_std,
+        seed=spec.seed,
+        publish_interval=publish_interval,
+        client_id=f"publisher-{spec.building_id}",
+        idf_path=spec.idf_path
+    )
+    try:
+        processor.process_csv()
+    finally:
+        processor.shutdown()
+    return spec.building_id, processor.published_count, time.perf_counter() - start
+
+
+def run_fleet(specs, workers=None, mqtt_broker=MQTT_BROKER, mqtt_port=MQTT_PORT, publish_interval=0):
+    """
+    Replay a fleet of buildings across a process pool
+    :param specs: BuildingSpec of every building
+    :param workers: Number of worker processes (default: number of cores)
+    :param mqtt_broker: MQTT broker address
+    :param mqtt_port: MQTT broker port
+    :param publish_interval: Seconds each building waits between two timesteps (0 for a load test)
+    :return: Total number of published messages
+    """
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    total = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_building, spec, mqtt_broker, mqtt_port, publish_interval) for spec in specs]
+        for future in as_completed(futures):
+            try:
+                building_id, published, elapsed = future.result()
+            except Exception as e:
+                print(f"Building replay failed: {e}")
+                continue
+            total += published
+            print(f"{building_id}: {published} messages in {elapsed:.1f}s")
+
+    elapsed = time.perf_counter() - start
+    print(f"Fleet of {len(specs)} buildings published {total} messages in {elapsed:.1f}s "
+          f"({total / elapsed:.0f} msg/s with {workers} workers)")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a fleet of buildings to the MQTT broker")
+    parser.add_argument("--buildings", type=int, default=10, help="Number of perturbed copies of the sample")
+    parser.add_argument("--csv", nargs="*", help="Filtered EnergyPlus outputs, one building each")
+    parser.add_argument("--idf", nargs="*", help="IDF of each --csv output (default: the sample IDF)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of cores)")
+    parser.add_argument("--offset-step", type=int, default=0, help="Minutes between two perturbed copies")
+    parser.add_argument("--noise", type=float, default=0.01, help="Relative noise of the perturbed copies")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between two timesteps")
+    args = parser.parse_args()
+
+    fleet = csv_fleet(args.csv, args.idf) if args.csv else perturbed_fleet(args.buildings, offset_step_minutes=args.offset_step,
+                                                                 noise_std=args.noise)
+    try:
+        run_fleet(fleet, workers=args.workers, publish_interval=args.interval)
+    except KeyboardInterrupt:
+        print("\nFleet shutting down...")
@@ -1,20 +1,45 @@
+import os
 import time
+import random
+import threading
 import paho.mqtt.client as mqtt
+from src.constants import (READY_TIMEOUT, DRAIN_TIMEOUT, RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY, PUBLISH_TIMEOUT,
+                           OFFLINE_BUFFER_SIZE, OFFLINE_SPOOL_DIR, OFFLINE_SPOOL_SIZE, OFFLINE_DRAIN_BATCH)
+from src.mqtt_classes.offline_buffer import OfflineBuffer
+from src.tracing import tracer
 
 
 class MQTTPublisher:
-    def __init__(self, broker_address='localhost', broker_port=1883, client_id=None):
+    def __init__(self, broker_address='localhost', broker_port=1883, client_id=None,
+                 buffer_size=OFFLINE_BUFFER_SIZE, spool_dir=OFFLINE_SPOOL_DIR, spool_size=OFFLINE_SPOOL_SIZE):
         """
         Initialize MQTT Publisher
         :param broker_address: IP address or hostname of MQTT broker (default: 'localhost')
         :param broker_port: Port of MQTT broker (default: 1883)
         :param client_id: Client ID for this publisher (default: None - random ID will be generated)
+        :param buffer_size: Messages buffered in memory while the broker is unreachable
+        :param spool_dir: Directory of the file the buffer overflows to (None to drop new messages when full)
+        :param spool_size: Messages held in the spool file
         """
         self.broker_address = broker_address
         self.broker_port = broker_port
         self.client_id = client_id
         self.client = None
         self.connected = False
+        self.connected_event = threading.Event()
+        self.in_flight = []
+        self.in_flight_lock = threading.Lock()
+
+        # Reconnection with backoff, and the buffer of messages published while disconnected
+        self.network_thread = None
+        self.stopping = threading.Event()
+        self.reconnect_attempt = 0
+        self.reconnects = 0
+        spool_path = os.path.join(spool_dir, f"{client_id or 'publisher'}-{os.getpid()}.jsonl") if spool_dir else None
+        self.offline = OfflineBuffer(buffer_size, spool_path, spool_size)
+        self.buffer_lock = threading.Lock()
+        # QoS 0 messages drained from the buffer, kept until written (the client does not retry them)
+        self.drained = []
 
         # Callback references
         self.on_publish_callback = None
@@ -25,16 +50,23 @@ class MQTTPublisher:
         """Called when the broker responds to our connection request"""
         if rc == 0:
             self.connected = True
+            self.reconnect_attempt = 0
             print(f"A Publisher Is Connected to MQTT Broker at {self.broker_address}:{self.broker_port}\n")
+            if len(self.offline):
+                print(f"Draining offline buffer: {self.buffer_stats()}")
             if self.on_connect_callback:
                 self.on_connect_callback(client, userdata, flags, rc)
+            self.connected_event.set()
         else:
             print(f"Connection failed with result code {rc}")
 
     def on_disconnect(self, client, userdata, rc):
         """Called when the client disconnects from the broker"""
         self.connected = False
+        self.connected_event.clear()
         print(f"Disconnected from MQTT Broker (rc: {rc})")
+        if not self.stopping.is_set():
+            print("Buffering messages until reconnected")
         if self.on_disconnect_callback:
             self.on_disconnect_callback(client, userdata, rc)
 
@@ -44,8 +76,12 @@ class MQTTPublisher:
         if self.on_publish_callback:
             self.on_publish_callback(client, userdata, mid)
 
-    def connect(self):
-        """Connect to the MQTT broker"""
+    def connect(self, timeout=READY_TIMEOUT):
+        """
+        Connect to the MQTT broker and wait for its acknowledgement (CONNACK)
+        :param timeout: Seconds to wait for the broker
+        :return: True once connected, False if the broker did not accept the connection in time
+        """
         self.client = mqtt.Client(client_id=self.client_id)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
@@ -53,29 +89,165 @@ class MQTTPublisher:
 
         try:
             self.client.connect(self.broker_address, port=self.broker_port)
-            # Start network loop in a separate thread
-            self.client.loop_start()
-            time.sleep(3)
         except Exception as e:
+            # The network thread keeps retrying; publishes are buffered meanwhile
             print(f"Connection error: {e}")
 
-    def disconnect(self):
-        """Disconnect from the MQTT broker"""
-        if self.client and self.connected:
-            self.client.disconnect()
-            self.client.loop_stop()
+        # Start network loop in a separate thread
+        self.stopping.clear()
+        self.network_thread = threading.Thread(target=self.run_network_loop, name="mqtt-publisher", daemon=True)
+        self.network_thread.start()
+
+        if not self.connected_event.wait(timeout):
+            print(f"No acknowledgement from MQTT Broker at {self.broker_address}:{self.broker_port} after {timeout}s")
+        return self.connected
+
+    def reconnect_delay(self):
+        """Exponential backoff with full jitter, so a fleet of publishers does not reconnect in lockstep"""
+        cap = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** self.reconnect_attempt)
+        return random.uniform(RECONNECT_MIN_DELAY, max(RECONNECT_MIN_DELAY, cap))
+
+    def run_network_loop(self):
+        """Run the client's network loop, reconnecting after connection losses and draining the offline buffer"""
+        while not self.stopping.is_set():
+            if self.connected and len(self.offline):
+                self.drain_offline()
+
+            rc = self.client.loop(timeout=0.1 if len(self.offline) else 1.0)
+            if self.drained:
+                self.requeue_lost()
+            if rc == mqtt.MQTT_ERR_SUCCESS or self.stopping.is_set():
+                continue
+
+            delay = self.reconnect_delay()
+            self.reconnect_attempt += 1
+            if self.stopping.wait(delay):
+                break
+            try:
+                self.client.reconnect()
+                self.reconnects += 1
+            except Exception as e:
+                print(f"Reconnection to MQTT Broker failed (attempt {self.reconnect_attempt}): {e}")
+
+    def drain_offline(self):
+        """Hand a batch of buffered messages to the client, oldest first; the network loop sends them"""
+        with self.in_flight_lock:
+            unsent = sum(not info.is_published() for info in self.in_flight)
+        if unsent >= OFFLINE_DRAIN_BATCH:
+            return
+
+        with self.buffer_lock:
+            for _ in range(OFFLINE_DRAIN_BATCH):
+                message = self.offline.popleft()
+                if message is None:
+                    break
+                result = self.client.publish(*message)
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    self.offline.appendleft(message)
+                    break
+                self.track(result)
+                if message[2] == 0:
+                    self.drained.append((message, result))
+            if not len(self.offline):
+                print(f"Offline buffer drained: {self.buffer_stats()}")
+
+    def requeue_lost(self):
+        """
+        Put the drained QoS 0 messages lost with the connection back in front of the offline buffer, the same
+        check publish() makes for the messages it sends
+        """
+        with self.buffer_lock:
+            pending = [(message, info) for message, info in self.drained if not info.is_published()]
+            if self.connected:
+                self.drained = pending
+                return
+            self.drained = []
+            for message, _ in reversed(pending):
+                self.offline.appendleft(message)
+
+    def buffer_stats(self):
+        """Occupancy and drop counts of the offline buffer, and the number of reconnections"""
+        return dict(self.offline.stats(), reconnects=self.reconnects)
+
+    def track(self, result):
+        """Keep a sent message until it is published, for flush()"""
+        with self.in_flight_lock:
+            if len(self.in_flight) >= OFFLINE_DRAIN_BATCH:
+                self.in_flight = [info for info in self.in_flight if not info.is_published()]
+            self.in_flight.append(result)
+
+    def flush(self, timeout=DRAIN_TIMEOUT):
+        """
+        Wait until the offline buffer is drained (reconnecting if needed) and every message handed to the client
+        has been sent (QoS 0) or acknowledged (QoS 1 and 2)
+        :return: True if nothing is left buffered or in flight
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.offline) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if len(self.offline):
+            print(f"{len(self.offline)} buffered messages not sent: {self.buffer_stats()}")
+
+        with self.in_flight_lock:
+            pending, self.in_flight = self.in_flight, []
+        for info in pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.connected:
+                break
+            try:
+                info.wait_for_publish(timeout=remaining)
+            except (ValueError, RuntimeError) as e:
+                print(f"Message {info.mid} not flushed: {e}")
+        left = sum(not info.is_published() for info in pending)
+        if left:
+            print(f"{left} messages still in flight after flushing")
+        return left == 0 and not len(self.offline)
+
+    def disconnect(self, timeout=DRAIN_TIMEOUT):
+        """Flush the buffered and in-flight messages, then disconnect from the MQTT broker"""
+        if self.client is None:
+            return
+        self.flush(timeout)
+        if self.offline.high_water:
+            print(f"Offline buffer: {self.buffer_stats()}")
+        self.stopping.set()
+        self.client.disconnect()
+        if self.network_thread:
+            self.network_thread.join()
+        with self.buffer_lock:
+            self.offline.close()
 
     def publish(self, topic, payload, qos=0, retain=False):
-        """Publish a message to a topic"""
-        if self.client and self.connected:
-            result = self.client.publish(topic, payload, qos=qos, retain=retain)
-            # Wait for publication to complete
-            result.wait_for_publish()
-            return result
-        else:
+        """
+        Publish a message to a topic. While the broker is unreachable (or older messages are still buffered),
+        the message is buffered and sent in order once reconnected.
+        :return: MQTTMessageInfo of the sent message, or None if it was buffered or dropped
+        """
+        if self.client is None:
             print("Not connected to broker. Cannot publish.")
             return None
 
+        message = (topic, payload, qos, retain)
+        with tracer.span("mqtt_publish", topic=topic, qos=qos):
+            with self.buffer_lock:
+                if not self.connected or len(self.offline):
+                    self.offline.append(message)
+                    return None
+                result = self.client.publish(topic, payload, qos=qos, retain=retain)
+                sent = result.rc == mqtt.MQTT_ERR_SUCCESS
+                if sent:
+                    self.track(result)
+
+            # Wait for publication to complete
+            if sent:
+                result.wait_for_publish(timeout=PUBLISH_TIMEOUT)
+            if qos == 0 and (not sent or not result.is_published() and not self.connected):
+                # Lost with the connection before being written (the client only retries QoS 1 and 2 itself)
+                with self.buffer_lock:
+                    self.offline.appendleft(message)
+                return None
+        return result
+
     def set_on_publish_callback(self, callback):
         """Set a custom callback for when messages are published"""
         self.on_publish_callback = callback
@@ -1,29 +1,43 @@
+import time
+import threading
 import paho.mqtt.client as mqtt
+from src.constants import READY_TIMEOUT, DRAIN_TIMEOUT
 
 
 class MQTTSubscriber:
-    def __init__(self, broker_address='localhost', broker_port=1883, client_id=None, topic=None):
+    def __init__(self, broker_address='localhost', broker_port=1883, client_id=None, topic=None,
+                 protocol=mqtt.MQTTv311):
         """
         Initialize MQTT Subscriber
         :param broker_address: IP address or hostname of MQTT broker (default: 'localhost')
         :param broker_port: Port of MQTT broker (default: 1883)
         :param client_id: Client ID for this subscriber (default: None - random ID will be generated)
         :param topic: Topic to subscribe to (default: None)
+        :param protocol: MQTT protocol version (mqtt.MQTTv5 for shared subscriptions)
         """
         self.broker_address = broker_address
         self.broker_port = broker_port
         self.client_id = client_id
         self.topic = topic
+        self.protocol = protocol
         self.client = None
         self.connected = False
         self.subscribed = False
+        self.topics = []
         self.received_messages = []
 
+        # Readiness: CONNACK, then a SUBACK/UNSUBACK for every request sent
+        self.connected_event = threading.Event()
+        self.acks = threading.Condition()
+        self.pending_acks = set()
+        self.early_acks = set()
+        self.in_flight = []
+
         self.on_message_callback = None
         self.on_connect_callback = None
         self.on_disconnect_callback = None
 
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """Called when the broker responds to our connection request"""
         if rc == 0:
             self.connected = True
@@ -32,12 +46,15 @@ class MQTTSubscriber:
                 self.subscribe(self.topic)
             if self.on_connect_callback:
                 self.on_connect_callback(client, userdata, flags, rc)
+            # Set after the callback, so the subscriptions it sends are pending before anyone waits on them
+            self.connected_event.set()
         else:
             print(f"Connection failed with result code {rc}")
 
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         """Called when the client disconnects from the broker"""
         self.connected = False
+        self.connected_event.clear()
         print(f"Disconnected from MQTT Broker (rc: {rc})")
         if self.on_disconnect_callback:
             self.on_disconnect_callback(client, userdata, rc)
@@ -55,12 +72,55 @@ class MQTTSubscriber:
         if self.on_message_callback:
             self.on_message_callback(client, userdata, message)
 
+    def on_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        """Called when the broker acknowledges a subscription (SUBACK); MQTT 5 grants reason codes"""
+        if any(getattr(qos, "is_failure", qos == 0x80) for qos in granted_qos):
+            print(f"Subscription {mid} refused by the broker")
+        self._acked(mid)
+
+    def on_unsubscribe(self, client, userdata, mid, *args):
+        """Called when the broker acknowledges an unsubscription (UNSUBACK)"""
+        self._acked(mid)
+
+    def _sent(self, mid):
+        """Track a request awaiting its acknowledgement (which may already have arrived)"""
+        with self.acks:
+            if mid in self.early_acks:
+                self.early_acks.discard(mid)
+            else:
+                self.pending_acks.add(mid)
+
+    def _acked(self, mid):
+        with self.acks:
+            if mid in self.pending_acks:
+                self.pending_acks.discard(mid)
+                self.acks.notify_all()
+            else:
+                self.early_acks.add(mid)
+
+    def wait_until_ready(self, timeout=READY_TIMEOUT):
+        """
+        Wait until the broker acknowledged the connection and every subscription sent so far
+        :return: True if ready within timeout
+        """
+        deadline = time.monotonic() + timeout
+        if not self.connected_event.wait(timeout):
+            print(f"No acknowledgement from MQTT Broker at {self.broker_address}:{self.broker_port} after {timeout}s")
+            return False
+        with self.acks:
+            if not self.acks.wait_for(lambda: not self.pending_acks, max(0.0, deadline - time.monotonic())):
+                print(f"{len(self.pending_acks)} subscriptions not acknowledged after {timeout}s")
+                return False
+        return True
+
     def connect(self):
         """Connect to the MQTT broker"""
-        self.client = mqtt.Client(client_id=self.client_id)
+        self.client = mqtt.Client(client_id=self.client_id, protocol=self.protocol)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        self.client.on_subscribe = self.on_subscribe
+        self.client.on_unsubscribe = self.on_unsubscribe
 
         try:
             self.client.connect(self.broker_address, port=self.broker_port)
@@ -68,21 +128,74 @@ class MQTTSubscriber:
         except Exception as e:
             print(f"Connection error: {e}")
 
-    def disconnect(self):
-        """Disconnect from the MQTT broker"""
+    def disconnect(self, timeout=DRAIN_TIMEOUT):
+        """Flush the messages published on this connection, then disconnect from the MQTT broker"""
         if self.client and self.connected:
+            self.flush(timeout)
             self.client.disconnect()
             self.client.loop_stop()
 
     def subscribe(self, topic, qos=0):
-        """Subscribe to a topic"""
+        """Subscribe to a topic; wait_until_ready() waits for the acknowledgement"""
         if self.client and self.connected:
-            self.client.subscribe(topic, qos=qos)
+            result, mid = self.client.subscribe(topic, qos=qos)
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                self._sent(mid)
+                if topic not in self.topics:
+                    self.topics.append(topic)
             self.subscribed = True
             print(f"Subscribed to topic: {topic}")
         else:
             print("Not connected to broker. Cannot subscribe.")
 
+    def unsubscribe_all(self, timeout=DRAIN_TIMEOUT):
+        """
+        Unsubscribe from every topic and wait for the acknowledgement. Messages are delivered in order on the
+        connection, so every message received before the UNSUBACK has been handed to on_message by then.
+        :return: True if the broker acknowledged within timeout
+        """
+        if not (self.client and self.connected and self.topics):
+            return True
+        result, mid = self.client.unsubscribe(self.topics)
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        self._sent(mid)
+        self.topics = []
+        self.subscribed = False
+        with self.acks:
+            return self.acks.wait_for(lambda: mid not in self.pending_acks, timeout)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Publish a message on the subscriber's own connection (e.g. alerts derived from received messages)"""
+        if self.client and self.connected:
+            result = self.client.publish(topic, payload, qos=qos, retain=retain)
+            self.in_flight = [info for info in self.in_flight if not info.is_published()]
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.in_flight.append(result)
+            return result
+        print("Not connected to broker. Cannot publish.")
+        return None
+
+    def flush(self, timeout=DRAIN_TIMEOUT):
+        """
+        Wait until every message published on this connection has been sent or acknowledged
+        :return: True if nothing is left in flight
+        """
+        deadline = time.monotonic() + timeout
+        pending, self.in_flight = self.in_flight, []
+        for info in pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.connected:
+                break
+            try:
+                info.wait_for_publish(timeout=remaining)
+            except (ValueError, RuntimeError) as e:
+                print(f"Message {info.mid} not flushed: {e}")
+        left = sum(not info.is_published() for info in pending)
+        if left:
+            print(f"{left} messages still in flight after flushing")
+        return left == 0
+
     def set_on_message_callback(self, callback):
         """Set a custom callback for when messages are received"""
         self.on_message_callback = callback
@@ -0,0 +1,101 @@
+import os
+import json
+import base64
+from collections import deque
+
+
+class OfflineBuffer:
+    def __init__(self, capacity, spool_path=None, spool_capacity=0):
+        """
+        FIFO of messages published while the broker is unreachable: held in memory, overflowing to an
+        append-only spool file when one is configured. Messages that fit in neither are dropped and counted.
+        Every message in memory is older than every spooled message, so draining preserves publish order.
+        :param capacity: Messages held in memory
+        :param spool_path: File the buffer overflows to once memory is full (None to drop instead)
+        :param spool_capacity: Messages held in the spool file
+        """
+        self.capacity = capacity
+        self.spool_path = spool_path
+        self.spool_capacity = spool_capacity if spool_path else 0
+        self.memory = deque()
+        self.spool_file = None
+        self.read_offset = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.memory) + self.spooled
+
+    def append(self, message):
+        """
+        Buffer a message
+        :param message: (topic, payload, qos, retain)
+        :return: False if the buffer is full and the message was dropped
+        """
+        if not self.spooled and len(self.memory) < self.capacity:
+            self.memory.append(message)
+        elif self.spooled < self.spool_capacity:
+            self._spool(message)
+        else:
+            self.dropped += 1
+            return False
+        self.high_water = max(self.high_water, len(self))
+        return True
+
+    def appendleft(self, message):
+        """Put back a message taken from the buffer that could not be sent"""
+        self.memory.appendleft(message)
+
+    def popleft(self):
+        """Oldest buffered message, or None if the buffer is empty"""
+        if not self.memory and self.spooled:
+            self._unspool()
+        return self.memory.popleft() if self.memory else None
+
+    def stats(self):
+        return {
+            "buffered": len(self.memory),
+            "spooled": self.spooled,
+            "dropped": self.dropped,
+            "high_water": self.high_water
+        }
+
+    def close(self):
+        """Close the spool file; messages still spooled are discarded"""
+        if self.spool_file:
+            self.spool_file.close()
+            self.spool_file = None
+            os.remove(self.spool_path)
+        self.spooled = 0
+
+    def _spool(self, message):
+        if self.spool_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+            self.spool_file = open(self.spool_path, "w+", encoding="utf-8")
+            self.read_offset = 0
+        topic, payload, qos, retain = message
+        record = {"topic": topic, "qos": qos, "retain": retain}
+        if isinstance(payload, bytes):
+            record["payload_b64"] = base64.b64encode(payload).decode("ascii")
+        else:
+            record["payload"] = payload
+        self.spool_file.seek(0, os.SEEK_END)
+        self.spool_file.write(json.dumps(record) + "\n")
+        self.spooled += 1
+
+    def _unspool(self):
+        """Move the oldest spooled messages back to memory"""
+        self.spool_file.flush()
+        self.spool_file.seek(self.read_offset)
+        while self.spooled and len(self.memory) < self.capacity:
+            record = json.loads(self.spool_file.readline())
+            payload = base64.b64decode(record["payload_b64"]) if "payload_b64" in record else record["payload"]
+            self.memory.append((record["topic"], payload, record["qos"], record["retain"]))
+            self.spooled -= 1
+        self.read_offset = self.spool_file.tell()
+
+        if not self.spooled:
+            self.spool_file.seek(0)
+            self.spool_file.truncate()
+            self.read_offset = 0
@@ -1,21 +1,75 @@
 import json
 import csv
 import time
+import random
+from datetime import timedelta
 from src.mqtt_classes.mqtt_publisher import MQTTPublisher
-from src.constants import FILTERED_DATA_CSV, MQTT_PORT, MQTT_BROKER
+from src.constants import (FILTERED_DATA_CSV, MQTT_PORT, MQTT_BROKER, IDF_PATH, TOPIC_PARTITIONS,
+                           STATE_SNAPSHOTS_ENABLED, STATE_PUBLISH_INTERVAL)
 from src.utils import parse_datetime
+from src.tracing import tracer
+from src.topics import THERMAL_ZONES_METRICS, SITE_METRICS, building_topic, partition_key, partition_of, state_topic
+from src.topology import load_zone_index
+
+
+# Field of a thermal_zone payload and the CSV column it is read from
+ZONE_FIELD_COLUMNS = [
+    ("mean_air_temperature", "{prefix}:Zone Mean Air Temperature"),
+    ("operative_temperature", "{prefix}:Zone Operative Temperature"),
+    ("air_relative_humidity", "{prefix}:Zone Air Relative Humidity"),
+    ("air_co2_concentration", "{prefix}:Zone Air CO2 Concentration"),
+    ("infiltration_air_change_rate", "{prefix}:Zone Infiltration Air Change Rate"),
+    ("mech_ventilation_air_changes", "{prefix}:Zone Mechanical Ventilation Air Changes per Hour"),
+    ("internal_latent_gain", "{prefix}:Zone Total Internal Latent Gain Energy"),
+    ("cooling_rate", "{prefix} IDEAL LOADS AIR:Zone Ideal Loads Supply Air Total Cooling Rate"),
+    ("heating_rate", "{prefix} IDEAL LOADS AIR:Zone Ideal Loads Supply Air Total Heating Rate"),
+    ("people_sensible_heat", "{prefix}:Zone People Sensible Heating Rate"),
+    ("thermal_comfort_pmv", "PEOPLE {prefix}:Zone Thermal Comfort Fanger Model PMV"),
+    ("thermal_comfort_ppd", "PEOPLE {prefix}:Zone Thermal Comfort Fanger Model PPD"),
+]
 
 
 class PublishMetrics:
-    def __init__(self, csv_path, mqtt_broker='localhost', mqtt_port=1883):
+    def __init__(self, csv_path, mqtt_broker='localhost', mqtt_port=1883, building_id=None,
+                 time_offset=timedelta(0), noise_std=0.0, seed=None, publish_interval=2, client_id=None,
+                 idf_path=IDF_PATH, partitions=TOPIC_PARTITIONS, state_snapshots=STATE_SNAPSHOTS_ENABLED,
+                 state_interval=STATE_PUBLISH_INTERVAL):
         """
         Initialize CSV to MQTT converter
         :param csv_path: Path to the CSV file
         :param mqtt_broker: MQTT broker address
         :param mqtt_port: MQTT broker port
+        :param building_id: Building identifier used as tag and topic level (None for the single-building topics)
+        :param time_offset: Shift applied to every timestamp of the replay
+        :param noise_std: Standard deviation of the relative gaussian noise applied to every value (0 for none)
+        :param seed: Seed of the noise generator
+        :param publish_interval: Seconds to wait between two timesteps
+        :param client_id: MQTT client ID (default: None - random ID will be generated)
+        :param idf_path: IDF the CSV was simulated from, which defines the building's zones
+        :param partitions: Number of topic partitions; each zone (and the site metrics of each building) is
+            published on the partition crc32(id) % partitions, so one subscriber of a group sees all of it in order
+            (0 for unpartitioned topics)
+        :param state_snapshots: Whether to also publish a retained snapshot of the latest state of every zone and
+            of the site, so a new subscriber gets the current picture of the building from the broker
+        :param state_interval: Seconds between two snapshots of a zone or of the site
         """
         self.csv_path = csv_path
-        self.mqtt_publisher = MQTTPublisher(broker_address=mqtt_broker, broker_port=mqtt_port)
+        self.building_id = building_id
+        self.time_offset = time_offset
+        self.noise_std = noise_std
+        self.rng = random.Random(seed)
+        self.publish_interval = publish_interval
+        self.partitions = partitions
+        self.site_metrics_topic = building_topic(SITE_METRICS, building_id, self.partition(partition_key(building_id)))
+        self.site_state_topic = state_topic(building_id)
+        self.state_snapshots = state_snapshots
+        self.state_interval = state_interval
+        self.state_published_at = {}
+        self.pending_states = {}
+        self.published_count = 0
+        self.zone_index = load_zone_index(idf_path)
+        self.zone_plan = None
+        self.mqtt_publisher = MQTTPublisher(broker_address=mqtt_broker, broker_port=mqtt_port, client_id=client_id)
         self.mqtt_publisher.connect()
 
     def process_csv(self):
@@ -25,74 +79,129 @@ class PublishMetrics:
         with open(self.csv_path, mode='r') as csv_file:
             csv_reader = csv.DictReader(csv_file)
 
-            for row in csv_reader:
-                try:
-                    dt_obj = parse_datetime(row['DateTime'])
-                    timestamp = dt_obj.isoformat() + 'Z'
-                except ValueError as e:
-                    print(f"Error parsing DateTime '{row['DateTime']}': {e}")
-                    continue
-
-                for block in ['BLOCK1', 'BLOCK2']:
-                    for zone in ['OFFICEXSW', 'OFFICEXSE', 'OFFICEXNW', 'OFFICEXNE', 'CORRIDOR']:
-                        for floor in ['X1F', 'X2F']:
-                            zone_prefix = f"{block}:{zone}{floor}"
-
-                            temp_key = f"{zone_prefix}:Zone Mean Air Temperature"
-                            if temp_key not in row:
-                                continue
-
-                            payload = {
-                                "measurement": "thermal_zone",
-                                "tags": {
-                                    "zone_id": f"{block}:{zone}:{floor}"
-                                },
-                                "time": timestamp,
-                                "fields": {
-                                    "mean_air_temperature": float(row[f"{zone_prefix}:Zone Mean Air Temperature"]),
-                                    "operative_temperature": float(row[f"{zone_prefix}:Zone Operative Temperature"]),
-                                    "air_relative_humidity": float(row[f"{zone_prefix}:Zone Air Relative Humidity"]),
-                                    "air_co2_concentration": float(row[f"{zone_prefix}:Zone Air CO2 Concentration"]),
-                                    "infiltration_air_change_rate": float(
-                                        row[f"{zone_prefix}:Zone Infiltration Air Change Rate"]),
-                                    "mech_ventilation_air_changes": float(
-                                        row[f"{zone_prefix}:Zone Mechanical Ventilation Air Changes per Hour"]),
-                                    "internal_latent_gain": float(
-                                        row[f"{zone_prefix}:Zone Total Internal Latent Gain Energy"]),
-                                    "cooling_rate": float(row[
-                                                              f"{zone_prefix} IDEAL LOADS AIR:Zone Ideal Loads Supply Air Total Cooling Rate"]),
-                                    "heating_rate": float(row[
-                                                              f"{zone_prefix} IDEAL LOADS AIR:Zone Ideal Loads Supply Air Total Heating Rate"]),
-                                    "people_sensible_heat": float(
-                                        row[f"{zone_prefix}:Zone People Sensible Heating Rate"]),
-                                    "thermal_comfort_pmv": float(
-                                        row[f"PEOPLE {zone_prefix}:Zone Thermal Comfort Fanger Model PMV"]),
-                                    "thermal_comfort_ppd": float(
-                                        row[f"PEOPLE {zone_prefix}:Zone Thermal Comfort Fanger Model PPD"])
-                                }
-                            }
-
-                            self.mqtt_publisher.publish("building/thermal_zones_metrics", json.dumps(payload))
-
-                site_payload = {
-                    "measurement": "site_metrics",
+            while True:
+                with tracer.span("process_row"):
+                    with tracer.span("csv_parse"):
+                        row = next(csv_reader, None)
+                        timestamp = self.parse_timestamp(row) if row is not None else None
+
+                    if row is None:
+                        break
+                    if timestamp is not None:
+                        self.publish_row(row, timestamp)
+
+                if timestamp is not None and self.publish_interval:
+                    time.sleep(self.publish_interval)
+
+            print("Simulation Complete!!!")
+
+    def parse_timestamp(self, row):
+        """Return the ISO timestamp of a CSV row, or None if its DateTime cannot be parsed"""
+        try:
+            dt_obj = parse_datetime(row['DateTime']) + self.time_offset
+            return dt_obj.isoformat() + 'Z'
+        except ValueError as e:
+            print(f"Error parsing DateTime '{row['DateTime']}': {e}")
+            return None
+
+    def build_zone_plan(self, columns):
+        """
+        Resolve, once per CSV, the zones present in the file, their topic and the column of each field
+        :param columns: Header of the CSV
+        """
+        columns = set(columns)
+        plan = []
+        for zone in self.zone_index:
+            zone_columns = [(field, template.format(prefix=zone.csv_prefix)) for field, template in ZONE_FIELD_COLUMNS]
+            if zone_columns[0][1] not in columns:
+                continue
+            topic = building_topic(THERMAL_ZONES_METRICS, self.building_id,
+                                   self.partition(partition_key(self.building_id, zone.zone_id)))
+            plan.append((topic, state_topic(self.building_id, zone.zone_id), self.tags(zone_id=zone.zone_id),
+                         zone_columns))
+        return plan
+
+    def partition(self, key):
+        """Topic partition of a partition_key() (None when topics are not partitioned)"""
+        return partition_of(key, self.partitions) if self.partitions else None
+
+    def publish_row(self, row, timestamp):
+        """Publish the thermal zone and site metrics of one CSV row"""
+        if self.zone_plan is None:
+            self.zone_plan = self.build_zone_plan(row.keys())
+
+        for topic, zone_state_topic, tags, zone_columns in self.zone_plan:
+            with tracer.span("build_payload", measurement="thermal_zone"):
+                payload = {
+                    "measurement": "thermal_zone",
+                    "tags": tags,
                     "time": timestamp,
-                    "fields": {
-                        "interior_lights_electricity": float(row["InteriorLights:Electricity"]),
-                        "facility_electricity": float(row["Electricity:Facility"]),
-                        "outdoor_air_temp": float(row["Site Site Outdoor Air Drybulb Temperature"]),
-                        "diffuse_solar_radiation": float(row["Site Site Diffuse Solar Radiation Rate per Area"]),
-                        "direct_solar_radiation": float(row["Site Site Direct Solar Radiation Rate per Area"])
-                    }
+                    "fields": {field: self.read_value(row[column]) for field, column in zone_columns}
                 }
-                self.mqtt_publisher.publish("building/site_metrics", json.dumps(site_payload))
-                time.sleep(2)
 
-            print("Simulation Complete!!!")
+            self.publish_payload(topic, payload)
+            if self.state_snapshots:
+                self.update_state(zone_state_topic, payload)
+
+        with tracer.span("build_payload", measurement="site_metrics"):
+            site_payload = {
+                "measurement": "site_metrics",
+                "tags": self.tags(),
+                "time": timestamp,
+                "fields": {
+                    "interior_lights_electricity": self.read_value(row["InteriorLights:Electricity"]),
+                    "facility_electricity": self.read_value(row["Electricity:Facility"]),
+                    "outdoor_air_temp": self.read_value(row["Site Site Outdoor Air Drybulb Temperature"]),
+                    "diffuse_solar_radiation": self.read_value(row["Site Site Diffuse Solar Radiation Rate per Area"]),
+                    "direct_solar_radiation": self.read_value(row["Site Site Direct Solar Radiation Rate per Area"])
+                }
+            }
+        self.publish_payload(self.site_metrics_topic, site_payload)
+        if self.state_snapshots:
+            self.update_state(self.site_state_topic, site_payload)
+
+    def tags(self, **tags):
+        """Tags of a payload, including the building_id in fleet mode"""
+        if self.building_id:
+            tags["building_id"] = self.building_id
+        return tags
+
+    def read_value(self, raw_value):
+        """Convert a CSV cell to float, applying the configured noise"""
+        value = float(raw_value)
+        if self.noise_std:
+            value *= 1 + self.rng.gauss(0, self.noise_std)
+        return value
+
+    def publish_payload(self, topic, payload):
+        """Attach the trace context, encode and publish a payload"""
+        tracer.inject(payload)
+        with tracer.span("json_encode"):
+            message = json.dumps(payload)
+        self.mqtt_publisher.publish(topic, message)
+        self.published_count += 1
+
+    def update_state(self, topic, payload):
+        """Keep the latest payload of a zone or site, publishing it at most once every state_interval"""
+        self.pending_states[topic] = payload
+        now = time.monotonic()
+        if now - self.state_published_at.get(topic, float("-inf")) >= self.state_interval:
+            self.state_published_at[topic] = now
+            self.publish_state(topic)
+
+    def publish_state(self, topic):
+        """Publish the latest payload of a zone or site as a compact retained snapshot"""
+        payload = self.pending_states.pop(topic)
+        state = dict(payload["tags"], time=payload["time"], **payload["fields"])
+        self.mqtt_publisher.publish(topic, json.dumps(state, separators=(",", ":")), retain=True)
+        self.published_count += 1
 
     def shutdown(self):
-        """Clean up resources"""
+        """Publish the states not snapshotted yet, then clean up resources"""
+        for topic in list(self.pending_states):
+            self.publish_state(topic)
         self.mqtt_publisher.disconnect()
+        tracer.flush()
 
 
 if __name__ == "__main__":
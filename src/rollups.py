@@ -0,0 +1,167 @@
+import heapq
+from datetime import datetime, timezone
+from src.constants import (ROLLUP_WINDOWS, ROLLUP_ALLOWED_LATENESS, ROLLUP_RETENTION, ROLLUP_SAMPLE_HOURS)
+
+PPD_THRESHOLD = 10.0
+
+
+def rollup_measurement(measurement, window_name):
+    """Name of the measurement holding the rollups of a measurement, e.g. 'thermal_zone_rollup_1h'"""
+    return f"{measurement}_rollup_{window_name}"
+
+
+def to_epoch(timestamp):
+    """Seconds since the epoch of an ISO timestamp like '2005-01-01T00:10:00Z'"""
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class WindowAggregate:
+    __slots__ = ("stats", "ppd_over_threshold", "dirty", "times")
+
+    def __init__(self):
+        """Running sum, min, max and count of every field of one series in one window"""
+        self.stats = {}
+        self.ppd_over_threshold = 0
+        self.dirty = False
+        self.times = set()
+
+    def add(self, fields):
+        for field, value in fields.items():
+            value = float(value)
+            stat = self.stats.get(field)
+            if stat is None:
+                self.stats[field] = [value, value, value, 1]
+            else:
+                stat[0] += value
+                if value < stat[1]:
+                    stat[1] = value
+                if value > stat[2]:
+                    stat[2] = value
+                stat[3] += 1
+        if fields.get("thermal_comfort_ppd", 0) > PPD_THRESHOLD:
+            self.ppd_over_threshold += 1
+        self.dirty = True
+
+    def fields(self):
+        result = {}
+        for field, (total, minimum, maximum, count) in self.stats.items():
+            result[f"{field}_sum"] = total
+            result[f"{field}_mean"] = total / count
+            result[f"{field}_min"] = minimum
+            result[f"{field}_max"] = maximum
+            result[f"{field}_count"] = count
+        if "thermal_comfort_ppd" in self.stats:
+            result["ppd_over_10_hours"] = self.ppd_over_threshold * ROLLUP_SAMPLE_HOURS
+        return result
+
+
+class _Stream:
+    __slots__ = ("watermark", "close_heap", "evict_heap")
+
+    def __init__(self, watermark):
+        """Event-time progress of one building, with its windows ordered by end and by expiry"""
+        self.watermark = watermark
+        self.close_heap = []
+        self.evict_heap = []
+
+
+class RollupEngine:
+    def __init__(self, windows=None, allowed_lateness=ROLLUP_ALLOWED_LATENESS, retention=ROLLUP_RETENTION):
+        """
+        Incremental tumbling-window rollups of the ingested points.
+
+        Samples are end-labeled like EnergyPlus outputs (00:10 covers 00:00-00:10), so they fall into the
+        window containing their interval. A window closes and is emitted once the watermark of its building
+        (latest event time minus allowed_lateness) passes its end. Late samples for a closed window are
+        still accepted until retention has passed, and the corrected rollup is emitted again with the same
+        series and timestamp, so InfluxDB overwrites it. Older samples are dropped and counted. A sample whose
+        timestamp the window already holds (a redelivered message) is ignored and counted, as the raw storage
+        keeps one point per series and timestamp.
+        :param windows: Dict of window name to size in seconds (default: ROLLUP_WINDOWS)
+        :param allowed_lateness: Seconds of event time a window waits for out-of-order samples
+        :param retention: Seconds of event time a closed window can still be corrected
+        """
+        self.windows = windows or ROLLUP_WINDOWS
+        self.allowed_lateness = allowed_lateness
+        self.retention = retention
+        self.aggregates = {}
+        self.streams = {}
+        self.dropped_late = 0
+        self.duplicates = 0
+
+    def add(self, measurement, tags, timestamp, fields):
+        """
+        Add a point to every window it falls into
+        :return: Rollup records of the windows closed by this point, see emit()
+        """
+        event_time = to_epoch(timestamp)
+        series = tuple(sorted(tags.items()))
+        stream_id = tags.get("building_id")
+
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = self.streams[stream_id] = _Stream(event_time - self.allowed_lateness)
+        elif event_time - self.allowed_lateness > stream.watermark:
+            stream.watermark = event_time - self.allowed_lateness
+
+        for window_name, size in self.windows.items():
+            start = ((event_time - 1) // size) * size
+            end = start + size
+            if end + self.retention <= stream.watermark:
+                self.dropped_late += 1
+                continue
+
+            key = (stream_id, measurement, series, window_name, start)
+            aggregate = self.aggregates.get(key)
+            if aggregate is None:
+                aggregate = self.aggregates[key] = WindowAggregate()
+                heapq.heappush(stream.evict_heap, (end + self.retention, key))
+            if event_time in aggregate.times:
+                self.duplicates += 1
+                continue
+            aggregate.times.add(event_time)
+            if not aggregate.dirty:
+                heapq.heappush(stream.close_heap, (end, key))
+            aggregate.add(fields)
+
+        return self.advance(stream)
+
+    def advance(self, stream):
+        """Emit the dirty windows of a building whose end has passed its watermark and evict expired ones"""
+        records = []
+        while stream.close_heap and stream.close_heap[0][0] <= stream.watermark:
+            _, key = heapq.heappop(stream.close_heap)
+            aggregate = self.aggregates.get(key)
+            if aggregate is not None and aggregate.dirty:
+                records.append(self.emit(key, aggregate))
+
+        while stream.evict_heap and stream.evict_heap[0][0] <= stream.watermark:
+            _, key = heapq.heappop(stream.evict_heap)
+            self.aggregates.pop(key, None)
+        return records
+
+    def emit(self, key, aggregate):
+        """
+        Build the rollup record of a window
+        :return: Dict with measurement, tags, time (window start, ISO) and fields
+        """
+        stream_id, measurement, series, window_name, start = key
+        aggregate.dirty = False
+        return {
+            "measurement": rollup_measurement(measurement, window_name),
+            "tags": dict(series),
+            "time": datetime.fromtimestamp(start, tz=timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "fields": aggregate.fields()
+        }
+
+    def flush(self):
+        """Emit every window holding data not emitted yet, including windows that are still open"""
+        records = [self.emit(key, aggregate) for key, aggregate in self.aggregates.items() if aggregate.dirty]
+        for stream in self.streams.values():
+            stream.close_heap = []
+        return records
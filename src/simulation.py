@@ -0,0 +1,148 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from src.constants import IDF_PATH, EPW_PATH, EPLUSOUT_CSV_PATH, ENERGYPLUS_EXECUTABLE, SIMULATION_CACHE_DIR
+from src.utils import file_hash
+
+_executable_identities = {}
+
+
+def executable_identity(executable) -> str:
+    """
+    Resolved path and reported version of an executable (its SHA-256 when it reports none), memoized on path
+    and modification time, so different installations never share cache entries
+    """
+    path = os.path.realpath(shutil.which(executable) or executable)
+    key = (path, os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+    if key not in _executable_identities:
+        try:
+            completed = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=60)
+            version = completed.stdout.strip() if completed.returncode == 0 else ""
+        except (OSError, subprocess.SubprocessError):
+            version = ""
+        if not version and os.path.isfile(path):
+            version = file_hash(path)
+        _executable_identities[key] = f"{path} {version}"
+    return _executable_identities[key]
+
+
+class SimulationRunner:
+    def __init__(self, executable=ENERGYPLUS_EXECUTABLE, cache_dir=SIMULATION_CACHE_DIR, readvars=True,
+                 annual=True, extra_args=()):
+        """
+        Run EnergyPlus simulations, reusing cached outputs when the inputs did not change
+        :param executable: EnergyPlus executable (any binary accepting the EnergyPlus CLI, e.g. a test stub)
+        :param cache_dir: Directory holding one output directory per simulation key
+        :param readvars: Whether ReadVarsESO produces eplusout.csv (-r)
+        :param annual: Whether to force an annual simulation (-a)
+        :param extra_args: Additional command line arguments passed to EnergyPlus
+        """
+        self.executable = str(executable)
+        self.cache_dir = Path(cache_dir)
+        self.readvars = readvars
+        self.annual = annual
+        self.extra_args = list(extra_args)
+
+    def options(self):
+        """Options that change the simulation outputs and are therefore part of the cache key"""
+        return {
+            "executable": executable_identity(self.executable),
+            "readvars": self.readvars,
+            "annual": self.annual,
+            "extra_args": self.extra_args
+        }
+
+    def cache_key(self, idf_path, epw_path) -> str:
+        digest = hashlib.sha256()
+        digest.update(file_hash(idf_path).encode())
+        digest.update(file_hash(epw_path).encode())
+        digest.update(json.dumps(self.options(), sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def command(self, idf_path, epw_path, output_dir):
+        cmd = [self.executable, "-w", str(epw_path), "-d", str(output_dir)]
+        if self.readvars:
+            cmd.append("-r")
+        if self.annual:
+            cmd.append("-a")
+        return cmd + self.extra_args + [str(idf_path)]
+
+    def run(self, idf_path=IDF_PATH, epw_path=EPW_PATH, output_csv=None, verbose=True) -> Path:
+        """
+        Simulate an IDF with a weather file, or reuse the cached outputs of an identical earlier run
+        :param idf_path: EnergyPlus input file
+        :param epw_path: Weather file
+        :param output_csv: Where to copy eplusout.csv (None to leave it in the cache only)
+        :param verbose: Whether to print cache hits and misses
+        :return: Directory holding the simulation outputs
+        """
+        key = self.cache_key(idf_path, epw_path)
+        result_dir = self.cache_dir / key
+
+        if result_dir.is_dir():
+            if verbose:
+                print(f"Simulation cache hit for {Path(idf_path).name} x {Path(epw_path).name} ({key[:12]})")
+        else:
+            if verbose:
+                print(f"Simulating {Path(idf_path).name} x {Path(epw_path).name} ({key[:12]})...")
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            work_dir = Path(tempfile.mkdtemp(prefix=f".{key[:12]}-", dir=self.cache_dir))
+            try:
+                completed = subprocess.run(self.command(idf_path, epw_path, work_dir), capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise RuntimeError(f"EnergyPlus failed with exit code {completed.returncode}: "
+                                       f"{completed.stderr.strip()[-2000:]}")
+                # Publish the outputs atomically; a concurrent run of the same key may have won the race
+                try:
+                    os.rename(work_dir, result_dir)
+                except OSError:
+                    if not result_dir.is_dir():
+                        raise
+            finally:
+                if work_dir.exists():
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+        if output_csv:
+            output_dir = os.path.dirname(output_csv)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            shutil.copyfile(result_dir / "eplusout.csv", output_csv)
+
+        return result_dir
+
+    def sweep(self, idf_paths, epw_paths, workers=None):
+        """
+        Simulate every IDF variant with every weather file across a process pool
+        :param idf_paths: IDF variants
+        :param epw_paths: Weather files
+        :param workers: Number of worker processes (default: number of cores)
+        :return: Dict mapping (idf_path, epw_path) to the directory holding its outputs
+        """
+        jobs = {}
+        for idf_path, epw_path in product(idf_paths, epw_paths):
+            jobs.setdefault(self.cache_key(idf_path, epw_path), []).append((idf_path, epw_path))
+
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = {key: executor.submit(self.run, *pairs[0], None, False) for key, pairs in jobs.items()}
+            for key, future in futures.items():
+                try:
+                    result_dir = future.result()
+                except Exception as e:
+                    print(f"Simulation {key[:12]} failed: {e}")
+                    continue
+                for pair in jobs[key]:
+                    results[pair] = result_dir
+
+        print(f"Sweep complete: {len(results)}/{len(idf_paths) * len(epw_paths)} simulations available")
+        return results
+
+
+if __name__ == "__main__":
+    SimulationRunner().run(IDF_PATH, EPW_PATH, output_csv=EPLUSOUT_CSV_PATH)
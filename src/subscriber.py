@@ -1,48 +1,110 @@
 import time
 import json
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
-from src.constants import BUCKET_TOKEN, INFLUXDB_ORG, MQTT_BROKER, MQTT_PORT, INFLUXDB_URL
+import queue
+import threading
+import paho.mqtt.client as mqtt
+from src.constants import (BUCKET_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET, MQTT_BROKER, MQTT_PORT, INFLUXDB_URL,
+                           ROLLUPS_ENABLED, STATS_ENABLED, STATS_PUBLISH_INTERVAL, READY_TIMEOUT,
+                           DRAIN_TIMEOUT, WRITE_QUEUE_SIZE, DRAIN_QUIET_PERIOD, TOPIC_PARTITIONS, STORAGE_BACKEND,
+                           COLUMNAR_STORE_DIR, COLUMNAR_SEGMENT_ROWS)
+from src.fast_api.storage import open_backend
 from src.mqtt_classes.mqtt_subscriber import MQTTSubscriber
+from src.tracing import tracer
+from src.topics import (THERMAL_ZONES_METRICS, SITE_METRICS, ALERTS, STATS, parse_topic, building_topic, zone_topic,
+                        subscription_topics, unique_client_id)
+from src.rollups import RollupEngine
+from src.zone_stats import ZoneStatistics
 
 
 class InfluxDBStorage:
-    def __init__(self):
-        self.influx_client = InfluxDBClient(
-            url=INFLUXDB_URL,
-            token=BUCKET_TOKEN,
-            org=INFLUXDB_ORG,
-            timeout=30_000
-            # debug=True
-        )
-        self.write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
+    def __init__(self, rollups=ROLLUPS_ENABLED, stats=STATS_ENABLED, client_id=None,
+                 group=None, partitions=TOPIC_PARTITIONS, owned_partitions=None, backend=STORAGE_BACKEND):
+        """
+        Write the building metrics received over MQTT to InfluxDB (or to another storage backend)
+        :param rollups: Whether to also write hourly and daily rollup measurements
+        :param stats: Whether to keep streaming zone statistics and publish alerts and retained snapshots
+        :param client_id: MQTT client ID, unique per subscriber process (default: influxdb_writer-<host>-<pid>)
+        :param group: Shared subscription group (MQTT 5); the broker spreads the messages over its members
+        :param partitions: Number of topic partitions the publishers use (0 for unpartitioned topics)
+        :param owned_partitions: Partitions consumed by this subscriber (None for all of them)
+        :param backend: Storage backend, 'influx' or 'columnar' (embedded store in COLUMNAR_STORE_DIR)
+        """
+        if group and (rollups or stats):
+            # Rollups and statistics need every reading of a zone; use partitions to keep zones on one subscriber
+            print("Shared subscription spreads each zone over the group, rollups and zone statistics are disabled")
+            rollups = stats = False
+        self.topics = subscription_topics(partitions, owned_partitions, group)
+
+        self.rollups = RollupEngine() if rollups else None
+        self.zone_stats = ZoneStatistics() if stats else None
+        self.stats_published_at = {}
+
+        self.backend = backend
+        if backend == "columnar":
+            self.store = open_backend("columnar", root=COLUMNAR_STORE_DIR, segment_rows=COLUMNAR_SEGMENT_ROWS)
+        else:
+            self.store = open_backend(backend, url=INFLUXDB_URL, token=BUCKET_TOKEN, org=INFLUXDB_ORG,
+                                      bucket=INFLUXDB_BUCKET, timeout=30_000)
+
+        # Messages are written by a dedicated thread, so the MQTT network loop only enqueues them
+        self.write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.writer_thread = None
+        self.last_received = time.monotonic()
 
         self.mqtt_subscriber = MQTTSubscriber(
             broker_address=MQTT_BROKER,
             broker_port=MQTT_PORT,
-            client_id='influxdb_writer'
+            client_id=client_id or unique_client_id("influxdb_writer"),
+            protocol=mqtt.MQTTv5 if group else mqtt.MQTTv311
         )
 
         self.mqtt_subscriber.set_on_message_callback(self.on_message_received)
         self.mqtt_subscriber.set_on_connect_callback(self.on_connect)
 
     def on_connect(self, client, userdata, flags, rc):
-        """Subscribe to topics when connected"""
-        self.mqtt_subscriber.subscribe("building/thermal_zones_metrics")
-        self.mqtt_subscriber.subscribe("building/site_metrics")
+        """Subscribe to the single-building and fleet topics (or this subscriber's partitions) when connected"""
+        for topic in self.topics:
+            self.mqtt_subscriber.subscribe(topic)
 
     def on_message_received(self, client, userdata, message):
-        """Handle incoming MQTT messages and write to InfluxDB"""
+        """Queue incoming MQTT messages for the writer thread (blocks the network loop while the queue is full)"""
+        self.last_received = time.monotonic()
+        self.write_queue.put(message)
+
+    def run_writer(self):
+        """Write the queued messages until the stop sentinel (None) is dequeued"""
+        while True:
+            message = self.write_queue.get()
+            try:
+                if message is None:
+                    return
+                self.process_message(message)
+            finally:
+                self.write_queue.task_done()
 
+    def process_message(self, message):
+        """Decode a received message and write it to the storage backend"""
         try:
-            payload = json.loads(message.payload.decode("utf-8"))
+            with tracer.span("json_decode", topic=message.topic) as decode_span:
+                payload = json.loads(message.payload.decode("utf-8"))
+                trace_context = tracer.adopt(decode_span, tracer.extract(payload))
+
+            building_id, kind = parse_topic(message.topic)
+            if building_id:
+                payload.setdefault("tags", {}).setdefault("building_id", building_id)
+
+            with tracer.span("on_message_received", parent=trace_context):
+                if kind == THERMAL_ZONES_METRICS:
+                    self.write_thermal_zone_data(payload)
+                elif kind == SITE_METRICS:
+                    self.write_site_metrics_data(payload)
 
-            if message.topic == "building/thermal_zones_metrics":
-                self.write_thermal_zone_data(payload)
-            elif message.topic == "building/site_metrics":
-                self.write_site_metrics_data(payload)
+                if kind and self.rollups is not None:
+                    self.update_rollups(payload)
+                if kind == THERMAL_ZONES_METRICS and self.zone_stats is not None:
+                    self.update_zone_stats(payload)
 
-            print(f"The New Data Is Written To InfluxDB Successfully!")
+            print(f"The New Data Is Written To {self.backend} Storage Successfully!")
             # print(f"Topic: {message.topic}")
             # print(f"Payload: {payload}\n")
 
@@ -52,52 +114,140 @@ class InfluxDBStorage:
             print(f"Error processing message: {e}")
 
     def write_thermal_zone_data(self, data):
-        """Write thermal zone data to InfluxDB"""
+        """Write thermal zone data to the storage backend"""
         try:
-            point = Point(data["measurement"]) \
-                .tag("zone_id", data["tags"]["zone_id"]) \
-                .time(data["time"], WritePrecision.NS)
+            with tracer.span("point_build"):
+                tags = {"zone_id": data["tags"]["zone_id"]}
+                if "building_id" in data["tags"]:
+                    tags["building_id"] = data["tags"]["building_id"]
 
-            for field, value in data["fields"].items():
-                point.field(field, round(float(value), 4))
+                fields = {field: round(float(value), 4) for field, value in data["fields"].items()}
 
-            response = self.write_api.write(bucket="gp2", record=point)
+            with tracer.span("storage_write"):
+                self.store.write(data["measurement"], tags, data["time"], fields)
             # print(f"Written thermal zone data!")
         except Exception as e:
             print(f"Error writing thermal zone data: {e}")
 
     def write_site_metrics_data(self, data):
-        """Write site metrics data to InfluxDB"""
+        """Write site metrics data to the storage backend"""
         try:
-            point = Point(data["measurement"]) \
-                .time(data["time"], WritePrecision.NS)
+            with tracer.span("point_build"):
+                tags = {}
+                if "building_id" in data.get("tags", {}):
+                    tags["building_id"] = data["tags"]["building_id"]
 
-            for field, value in data["fields"].items():
-                point.field(field, round(float(value), 4))
+                fields = {field: round(float(value), 4) for field, value in data["fields"].items()}
 
-            self.write_api.write(bucket="gp2", record=point)
+            with tracer.span("storage_write"):
+                self.store.write(data["measurement"], tags, data["time"], fields)
             # print("Written site metrics data!")
         except Exception as e:
             print(f"Error writing site metrics: {e}")
 
-    def start(self):
-        """Start the MQTT subscriber and flush bucket"""
+    def update_rollups(self, data):
+        """Feed a point to the rollup engine and write the windows it closes"""
+        with tracer.span("rollup_update"):
+            records = self.rollups.add(data["measurement"], data.get("tags", {}), data["time"], data["fields"])
+        self.write_rollups(records)
+
+    def update_zone_stats(self, data):
+        """Score a reading against its zone's running statistics, publish alerts and throttled snapshots"""
+        building_id = data["tags"].get("building_id")
+        zone_id = data["tags"]["zone_id"]
+        with tracer.span("zone_stats_update"):
+            alerts = self.zone_stats.update(building_id, zone_id, data["time"], data["fields"])
+
+        for alert in alerts:
+            self.mqtt_subscriber.publish(building_topic(ALERTS, building_id), json.dumps(alert), qos=1)
+
+        now = time.monotonic()
+        key = (building_id, zone_id)
+        if now - self.stats_published_at.get(key, float("-inf")) >= STATS_PUBLISH_INTERVAL:
+            self.stats_published_at[key] = now
+            snapshot = self.zone_stats.snapshot(building_id, zone_id)
+            self.mqtt_subscriber.publish(zone_topic(STATS, zone_id, building_id), json.dumps(snapshot), retain=True)
+
+    def write_rollups(self, records):
+        """Write rollup records to the storage backend"""
+        if not records:
+            return
+        try:
+            with tracer.span("storage_write", rollups=len(records)):
+                self.store.write_many(records)
+        except Exception as e:
+            print(f"Error writing rollups: {e}")
+
+    def wait_for_storage(self, timeout=READY_TIMEOUT):
+        """
+        Wait until the storage backend answers its health check (/ping for InfluxDB)
+        :return: True if the storage is up within timeout
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while not self.store.ping():
+            if time.monotonic() + delay > deadline:
+                print(f"{self.backend} storage not ready after {timeout}s")
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+        return True
+
+    def start(self, timeout=READY_TIMEOUT):
+        """
+        Start the writer thread and the MQTT subscriber once the storage is healthy
+        :return: True once the storage is up and the broker acknowledged the connection and every subscription
+        """
+        deadline = time.monotonic() + timeout
+        storage_ready = self.wait_for_storage(timeout)
+
+        self.writer_thread = threading.Thread(target=self.run_writer, name="influxdb-writer", daemon=True)
+        self.writer_thread.start()
         self.mqtt_subscriber.connect()
+        mqtt_ready = self.mqtt_subscriber.wait_until_ready(max(0.0, deadline - time.monotonic()))
+        return storage_ready and mqtt_ready
+
+    def drain(self, timeout=DRAIN_TIMEOUT, quiet_period=DRAIN_QUIET_PERIOD):
+        """
+        Stop receiving and write every message received so far. The broker forwards messages asynchronously,
+        so the tail of a flushed publisher can still be on its way: subscriptions are only dropped once no
+        message arrived for quiet_period.
+        :return: True if the queue was drained within timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            idle = time.monotonic() - self.last_received
+            if idle >= quiet_period:
+                break
+            time.sleep(min(quiet_period - idle, max(0.0, deadline - time.monotonic())))
+        self.mqtt_subscriber.unsubscribe_all(max(0.0, deadline - time.monotonic()))
+        if self.writer_thread is None:
+            return True
 
-    def stop(self):
-        """Clean up resources"""
-        self.mqtt_subscriber.disconnect()
-        self.write_api.close()
-        self.influx_client.close()
+        self.write_queue.put(None)
+        self.writer_thread.join(max(0.0, deadline - time.monotonic()))
+        if self.writer_thread.is_alive():
+            print(f"{self.write_queue.qsize()} messages not written after {timeout}s")
+            return False
+        return True
+
+    def stop(self, timeout=DRAIN_TIMEOUT):
+        """Drain the queued messages, flush the rollups and the published alerts, then clean up resources"""
+        self.drain(timeout)
+        if self.rollups is not None:
+            self.write_rollups(self.rollups.flush())
+        self.mqtt_subscriber.disconnect(timeout)
+        self.store.close()
+        tracer.flush()
         print("Clean shutdown complete")
 
 
 if __name__ == "__main__":
     storage = InfluxDBStorage()
     try:
-        storage.start()
-        while True:
-            time.sleep(1)
+        if not storage.start():
+            print("Subscriber started before its dependencies were ready, messages may be missed")
+        threading.Event().wait()
     except KeyboardInterrupt:
         print("\nShutdown requested...")
     except Exception as e:
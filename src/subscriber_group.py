@@ -0,0 +1,95 @@
+import os
+import signal
+import argparse
+import threading
+from multiprocessing import Process
+from src.constants import SUBSCRIBER_GROUP, TOPIC_PARTITIONS
+from src.subscriber import InfluxDBStorage
+from src.topics import unique_client_id
+
+
+def owned_partitions(index, workers, partitions):
+    """Partitions consumed by worker index of a group: every workers-th partition, starting at index"""
+    return [partition for partition in range(partitions) if partition % workers == index]
+
+
+def handle_sigterm(signum, frame):
+    """Drain on SIGTERM the same way as on Ctrl+C"""
+    raise KeyboardInterrupt
+
+
+def run_worker(index, workers, mode, group, partitions):
+    """
+    Run one subscriber of the group until interrupted, then drain it
+    :param index: Index of the worker in the group, part of its client ID (with the host and process ID)
+    :param workers: Number of workers in the group
+    :param mode: 'shared' (the broker spreads messages over the group) or 'partitioned' (each worker owns partitions)
+    :param group: Shared subscription group name
+    :param partitions: Number of topic partitions the publishers use
+    """
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    client_id = unique_client_id(f"influxdb_writer-{group}-{index}")
+    if mode == "partitioned":
+        storage = InfluxDBStorage(client_id=client_id, partitions=partitions,
+                                  owned_partitions=owned_partitions(index, workers, partitions))
+    else:
+        storage = InfluxDBStorage(client_id=client_id, group=group, partitions=partitions)
+
+    try:
+        if storage.start():
+            print(f"Subscriber {client_id} ready on {', '.join(storage.topics)}")
+        else:
+            print(f"Subscriber {client_id} started before its dependencies were ready, messages may be missed")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"\nSubscriber {client_id} shutdown requested...")
+    finally:
+        storage.stop()
+
+
+def run_group(workers=None, mode="shared", group=SUBSCRIBER_GROUP, partitions=TOPIC_PARTITIONS):
+    """
+    Run a group of subscriber processes consuming the metrics together
+    :param workers: Number of subscriber processes (default: number of cores)
+    :param mode: 'shared' or 'partitioned', see run_worker()
+    :param group: Shared subscription group name
+    :param partitions: Number of topic partitions the publishers use ('partitioned' mode requires at least workers)
+    """
+    workers = workers or os.cpu_count()
+    if mode == "partitioned" and partitions < workers:
+        raise ValueError(f"{workers} partitioned workers need at least {workers} topic partitions, got {partitions}")
+
+    processes = [Process(target=run_worker, args=(index, workers, mode, group, partitions),
+                         name=f"subscriber-{index}") for index in range(workers)]
+    for process in processes:
+        process.start()
+
+    def stop_workers(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    # Ctrl+C reaches every process of the terminal; forward SIGTERM so the workers drain as well
+    signal.signal(signal.SIGTERM, stop_workers)
+    for process in processes:
+        while True:
+            try:
+                process.join()
+                break
+            except KeyboardInterrupt:
+                continue
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a group of InfluxDB subscribers across processes")
+    parser.add_argument("--workers", type=int, default=None, help="Subscriber processes (default: number of cores)")
+    parser.add_argument("--mode", choices=["shared", "partitioned"], default="shared",
+                        help="'shared': MQTT 5 shared subscription, the broker spreads messages over the workers "
+                             "(no per-zone ordering, rollups and statistics disabled); "
+                             "'partitioned': each worker owns topic partitions, so every zone stays on one worker")
+    parser.add_argument("--group", default=SUBSCRIBER_GROUP, help="Shared subscription group name")
+    parser.add_argument("--partitions", type=int, default=TOPIC_PARTITIONS,
+                        help="Topic partitions the publishers use (see TOPIC_PARTITIONS)")
+    args = parser.parse_args()
+
+    run_group(args.workers, args.mode, args.group, args.partitions)
@@ -0,0 +1,93 @@
+import os
+import zlib
+import socket
+
+THERMAL_ZONES_METRICS = "thermal_zones_metrics"
+SITE_METRICS = "site_metrics"
+ALERTS = "alerts"
+STATS = "stats"
+METRICS_KINDS = (THERMAL_ZONES_METRICS, SITE_METRICS)
+
+# Single-building topics (no building_id) and fleet topics (building/<building_id>/...)
+SUBSCRIPTION_TOPICS = [
+    f"building/{THERMAL_ZONES_METRICS}",
+    f"building/{SITE_METRICS}",
+    f"building/+/{THERMAL_ZONES_METRICS}",
+    f"building/+/{SITE_METRICS}",
+]
+
+
+def building_topic(kind, building_id=None, partition=None):
+    """
+    Build the topic a building publishes a kind of metrics on
+    :param kind: THERMAL_ZONES_METRICS or SITE_METRICS
+    :param building_id: Building identifier (None for the single-building topics)
+    :param partition: Partition level appended to the topic (None for unpartitioned topics)
+    """
+    topic = f"building/{building_id}/{kind}" if building_id else f"building/{kind}"
+    if partition is not None:
+        topic += f"/{partition}"
+    return topic
+
+
+def parse_topic(topic):
+    """
+    Split a metrics topic, partitioned or not, into its building and kind
+    :return: (building_id, kind); building_id is None for single-building topics and kind is None for unknown topics
+    """
+    parts = topic.split("/")
+    if parts[0] != "building" or len(parts) < 2:
+        return None, None
+    if parts[1] in METRICS_KINDS and len(parts) <= 3:
+        return None, parts[1]
+    if len(parts) in (3, 4) and parts[2] in METRICS_KINDS:
+        return parts[1], parts[2]
+    return None, None
+
+
+def unique_client_id(prefix):
+    """MQTT client ID unique across hosts and processes; the broker disconnects a session whose ID is reused"""
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}"
+
+
+def partition_key(building_id=None, zone_id=None):
+    """
+    Key a zone's (or a site's) readings are partitioned on. Zone IDs repeat across buildings of the same model,
+    so fleet zones are keyed on building and zone, spreading the fleet over the partitions
+    """
+    if zone_id is None:
+        return building_id
+    return f"{building_id}/{zone_id}" if building_id else zone_id
+
+
+def partition_of(key, partitions):
+    """Stable partition of a partition_key(), the same in every process"""
+    return zlib.crc32((key or "").encode("utf-8")) % partitions
+
+
+def subscription_topics(partitions=0, owned=None, group=None):
+    """
+    Metrics topics a subscriber listens to
+    :param partitions: Number of topic partitions the publishers use (0 for unpartitioned topics)
+    :param owned: Partitions this subscriber consumes (None for all of them)
+    :param group: Shared subscription group; the broker spreads the messages across the group's members
+    """
+    if not partitions:
+        topics = list(SUBSCRIPTION_TOPICS)
+    else:
+        levels = ["+"] if owned is None else [str(partition) for partition in owned]
+        topics = [f"{topic}/{level}" for topic in SUBSCRIPTION_TOPICS for level in levels]
+    if group:
+        topics = [f"$share/{group}/{topic}" for topic in topics]
+    return topics
+
+
+def zone_topic(kind, zone_id, building_id=None):
+    """Topic of a per-zone message, e.g. building/stats/<zone_id> or building/<building_id>/stats/<zone_id>"""
+    return f"{building_topic(kind, building_id)}/{zone_id}"
+
+
+def state_topic(building_id=None, zone_id=None):
+    """Retained latest-state topic of a zone (building[/<building_id>]/zones/<zone_id>/state) or of the site"""
+    base = f"building/{building_id}" if building_id else "building"
+    return f"{base}/zones/{zone_id}/state" if zone_id else f"{base}/site/state"
@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import argparse
+from typing import Optional, List, Dict
+from dataclasses import dataclass, asdict
+from src.constants import IDF_PATH, ZONE_INDEX_CACHE_DIR
+from src.utils import file_hash
+
+FLOOR_SUFFIX = re.compile(r"^(?P<zone>.*?)(?P<floor>X\d+F)$", re.IGNORECASE)
+COMMENT = re.compile(r"!.*")
+
+
+@dataclass
+class ZoneInfo:
+    """A thermal zone of the building and where it sits"""
+    zone_id: str  # e.g. 'BLOCK1:OFFICEXSW:X1F', the zone_id tag written to InfluxDB
+    idf_name: str  # e.g. 'Block1:OfficeXSWX1f'
+    block: Optional[str]
+    zone: str
+    floor: Optional[str]
+    floor_area: Optional[float]
+    volume: Optional[float]
+    elevation: Optional[float]
+
+    @property
+    def csv_prefix(self):
+        """Prefix of the zone's columns in the EnergyPlus output CSV"""
+        return self.idf_name.upper()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _polygon_area(vertices):
+    """Area of a horizontal polygon (shoelace formula on X/Y)"""
+    area = 0.0
+    for (x1, y1, _), (x2, y2, _) in zip(vertices, vertices[1:] + vertices[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
+
+
+def split_zone_name(idf_name):
+    """
+    Split an IDF zone name like 'Block1:OfficeXSWX1f' into (block, zone, floor)
+    :return: ('BLOCK1', 'OFFICEXSW', 'X1F'); block and floor are None when the name does not carry them
+    """
+    block, _, name = idf_name.upper().rpartition(":")
+    match = FLOOR_SUFFIX.match(name)
+    if match and match.group("zone"):
+        return block or None, match.group("zone"), match.group("floor")
+    return block or None, name, None
+
+
+def parse_idf_zones(idf_path=IDF_PATH) -> List[ZoneInfo]:
+    """
+    Extract the zones of an IDF, with their floor area from the Zone object or, when it is
+    autocalculated, from the zone's floor surfaces
+    """
+    with open(idf_path, "r", encoding="latin-1") as f:
+        text = COMMENT.sub("", f.read())
+
+    zones = []
+    floor_surfaces = {}
+    for obj in text.split(";"):
+        head, _, body = obj.partition(",")
+        object_class = head.strip().lower()
+        if object_class == "zone":
+            fields = [field.strip() for field in body.split(",")] + [""] * 10
+            zones.append(fields)
+        elif object_class == "buildingsurface:detailed":
+            fields = [field.strip() for field in body.split(",")]
+            if len(fields) > 11 and fields[1].lower() == "floor":
+                coordinates = [_number(value) or 0.0 for value in fields[11:]]
+                vertices = list(zip(coordinates[0::3], coordinates[1::3], coordinates[2::3]))
+                floor_surfaces.setdefault(fields[3].upper(), []).append(vertices)
+
+    index = []
+    for fields in zones:
+        idf_name = fields[0]
+        block, zone, floor = split_zone_name(idf_name)
+        surfaces = floor_surfaces.get(idf_name.upper(), [])
+        floor_area = _number(fields[9])
+        if floor_area is None and surfaces:
+            floor_area = sum(_polygon_area(vertices) for vertices in surfaces)
+        elevation = min((z for vertices in surfaces for _, _, z in vertices), default=_number(fields[4]))
+
+        index.append(ZoneInfo(
+            zone_id=":".join(part for part in (block, zone, floor) if part),
+            idf_name=idf_name,
+            block=block,
+            zone=zone,
+            floor=floor,
+            floor_area=floor_area,
+            volume=_number(fields[8]),
+            elevation=elevation
+        ))
+    return index
+
+
+class ZoneIndex:
+    def __init__(self, zones: List[ZoneInfo]):
+        """
+        Lookup of the building's zones by ID, block and floor
+        :param zones: Zones in IDF order
+        """
+        self.zones = zones
+        self.by_id: Dict[str, ZoneInfo] = {zone.zone_id: zone for zone in zones}
+        self.blocks: Dict[str, List[str]] = {}
+        self.floors: Dict[str, List[str]] = {}
+        for zone in zones:
+            if zone.block:
+                self.blocks.setdefault(zone.block, []).append(zone.zone_id)
+            if zone.floor:
+                self.floors.setdefault(zone.floor, []).append(zone.zone_id)
+
+    def __contains__(self, zone_id):
+        return zone_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.zones)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def to_dict(self):
+        return {"zones": [asdict(zone) for zone in self.zones]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([ZoneInfo(**zone) for zone in data["zones"]])
+
+    def save(self, path, buildings=None):
+        """
+        :param buildings: Fleet building IDs simulated from this IDF, whose zones the API validates against the
+                          index (the single-building data is always covered)
+        """
+        data = self.to_dict()
+        if buildings:
+            data["buildings"] = list(buildings)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def load_zone_index(idf_path=IDF_PATH, cache_dir=ZONE_INDEX_CACHE_DIR) -> ZoneIndex:
+    """Zone index of an IDF, cached on disk under the IDF's hash"""
+    cache_path = os.path.join(cache_dir, f"{file_hash(idf_path)}.json")
+    if os.path.exists(cache_path):
+        return ZoneIndex.read(cache_path)
+
+    index = ZoneIndex(parse_idf_zones(idf_path))
+    index.save(cache_path)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the zone topology index of an IDF")
+    parser.add_argument("--idf", default=str(IDF_PATH), help="EnergyPlus input file")
+    parser.add_argument("--export", help="Also write the index to this path (e.g. src/fast_api/zone_index.json)")
+    parser.add_argument("--buildings", nargs="*", default=[],
+                        help="Fleet building IDs simulated from this IDF, recorded in the exported index")
+    args = parser.parse_args()
+
+    zone_index = load_zone_index(args.idf)
+    for info in zone_index:
+        print(f"{info.zone_id:<25} block={info.block} floor={info.floor} area={info.floor_area} m2")
+    if args.export:
+        zone_index.save(args.export, args.buildings)
+        print(f"Zone index written to {args.export}")
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from src.constants import (TRACING_ENABLED, TRACE_OUTPUT_PATH, PROFILER_ENABLED, PROFILER_INTERVAL,
+                           PROFILER_WINDOW, PROFILE_OUTPUT_PATH)
+
+
+class _NoopSpan:
+    """Span returned when tracing is disabled, so instrumented code pays almost nothing"""
+    context = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        """
+        A single timed stage of the ingestion path
+        :param tracer: Tracer that records the span when it ends
+        :param name: Stage name (e.g. 'csv_parse', 'influx_write')
+        :param trace_id: Identifier shared by every span of one reading
+        :param parent_id: Span ID of the parent span (None for a root span)
+        :param attributes: Extra key/values recorded with the span
+        """
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+
+    @property
+    def context(self):
+        """Trace context that can be carried to another process"""
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.attributes["error"] = repr(exc_val)
+        self.tracer._pop(self)
+        self.tracer._record(self)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=TRACING_ENABLED, output_path=TRACE_OUTPUT_PATH):
+        """
+        Minimal span tracer writing one JSON line per finished span
+        :param enabled: Whether spans are recorded at all
+        :param output_path: File the finished spans are appended to
+        """
+        self.enabled = enabled
+        self.output_path = output_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        self._stack().append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def _record(self, span):
+        line = json.dumps({
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "start_ns": span.start_ns,
+            "duration_us": (span.end_ns - span.start_ns) / 1000,
+            "thread": threading.current_thread().name,
+            "attributes": span.attributes
+        })
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+                self._file = open(self.output_path, "a")
+            self._file.write(line + "\n")
+
+    def span(self, name, parent=None, **attributes):
+        """
+        Start a span for a stage of the pipeline
+        :param name: Stage name
+        :param parent: Remote trace context (as returned by extract()); defaults to the current span
+        :param attributes: Extra key/values recorded with the span
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+
+        if parent is None:
+            stack = self._stack()
+            parent = stack[-1].context if stack else None
+
+        if parent:
+            return Span(self, name, parent["trace_id"], parent["span_id"], attributes)
+        return Span(self, name, os.urandom(16).hex(), None, attributes)
+
+    def inject(self, payload):
+        """Add the current trace context to an outgoing MQTT payload"""
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                payload["trace"] = stack[-1].context
+        return payload
+
+    @staticmethod
+    def extract(payload):
+        """Remove and return the trace context carried by an incoming MQTT payload"""
+        return payload.pop("trace", None)
+
+    @staticmethod
+    def adopt(span, context):
+        """
+        Move a still-open span into a remote trace, e.g. the decode span once the payload is known
+        :return: Context that the following spans of the message should use as their parent
+        """
+        if span is _NOOP_SPAN:
+            return None
+        if context:
+            span.trace_id = context["trace_id"]
+            span.parent_id = context["span_id"]
+            return context
+        return span.context
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL, window=PROFILER_WINDOW, output_path=PROFILE_OUTPUT_PATH):
+        """
+        Sampling profiler dumping stacks in the folded format read by flamegraph.pl / speedscope
+        :param interval: Seconds between two samples of every thread's stack
+        :param window: Seconds to sample before dumping the profile (None to sample until stop())
+        :param output_path: File the folded stacks are written to
+        """
+        self.interval = interval
+        self.window = window
+        self.output_path = output_path
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        if self.running:
+            return
+        self.samples.clear()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        print(f"Sampling profiler started (interval {self.interval}s, window {self.window}s)")
+
+    def stop(self):
+        """Stop sampling and dump the collected profile"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.window if self.window else None
+
+        while not self._stop_event.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._stop_event.wait(self.interval)
+
+        self.dump()
+
+    def dump(self):
+        """Write the folded stacks collected so far"""
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        with open(self.output_path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profile with {sum(self.samples.values())} samples written to {self.output_path}")
+
+
+tracer = Tracer()
+profiler = SamplingProfiler()
+
+
+def start_profiler_if_enabled():
+    """Start the shared profiler when PROFILER_ENABLED is set"""
+    if PROFILER_ENABLED:
+        profiler.start()
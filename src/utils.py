@@ -1,5 +1,7 @@
+import os
 import re
 import json
+import hashlib
 import statistics
 import pandas as pd
 from typing import Optional, List
@@ -7,6 +9,8 @@ from datetime import datetime, timedelta
 from influxdb_client import InfluxDBClient
 from src.constants import EPLUSOUT_CSV_PATH
 
+_file_hashes = {}
+
 
 def extract_zone_temperatures(
         input_path: str = EPLUSOUT_CSV_PATH,
@@ -176,6 +180,19 @@ def extract_specific_outputs(
     return filtered_df
 
 
+def file_hash(path) -> str:
+    """SHA-256 of a file, memoized on path, size and modification time"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
 def parse_datetime(dt_str):
     """Parse datetime string handling 24:00:00 special case"""
     dt_str = dt_str.strip()
@@ -0,0 +1,208 @@
+import os
+import numpy as np
+from functools import cached_property
+from src.constants import EPW_PATH, WEATHER_CACHE_DIR
+from src.utils import file_hash
+
+EPW_HEADER_LINES = 8
+
+# Column of every numeric field of an EPW data record
+EPW_FIELDS = {
+    "year": 0,
+    "month": 1,
+    "day": 2,
+    "hour": 3,
+    "minute": 4,
+    "dry_bulb_temperature": 6,
+    "dew_point_temperature": 7,
+    "relative_humidity": 8,
+    "atmospheric_pressure": 9,
+    "extraterrestrial_horizontal_radiation": 10,
+    "extraterrestrial_direct_normal_radiation": 11,
+    "horizontal_infrared_radiation": 12,
+    "global_horizontal_radiation": 13,
+    "direct_normal_radiation": 14,
+    "diffuse_horizontal_radiation": 15,
+    "global_horizontal_illuminance": 16,
+    "direct_normal_illuminance": 17,
+    "diffuse_horizontal_illuminance": 18,
+    "zenith_luminance": 19,
+    "wind_direction": 20,
+    "wind_speed": 21,
+    "total_sky_cover": 22,
+    "opaque_sky_cover": 23,
+    "visibility": 24,
+    "ceiling_height": 25,
+    "present_weather_observation": 26,
+    "precipitable_water": 28,
+    "aerosol_optical_depth": 29,
+    "snow_depth": 30,
+    "days_since_last_snowfall": 31,
+    "albedo": 32,
+    "liquid_precipitation_depth": 33,
+    "liquid_precipitation_rate": 34,
+}
+
+# Columns holding codes rather than quantities, kept as text (present weather codes keep their leading zeros)
+EPW_TEXT_FIELDS = {
+    "data_source_flags": 5,
+    "present_weather_codes": 27,
+}
+
+TIME_FIELDS = ("year", "month", "day", "hour", "minute")
+# Integer flags, stored as int64 rather than float32 like the physical quantities
+FLAG_FIELDS = ("present_weather_observation",)
+CACHE_VERSION = 2  # bumped when the parsed arrays change, so stale cache files are not read
+_memory_cache = {}
+
+
+class EPWWeather:
+    def __init__(self, header_lines, arrays):
+        """
+        Hourly weather records of an EPW file held in typed NumPy arrays
+        :param header_lines: The raw header lines (LOCATION, DESIGN CONDITIONS, ...), parsed on first use
+        :param arrays: Dict mapping every EPW_FIELDS and EPW_TEXT_FIELDS name to an array of 8,760 (or 8,784) records
+        """
+        self.header_lines = list(header_lines)
+        self.arrays = arrays
+
+    @classmethod
+    def parse(cls, path=EPW_PATH):
+        """Parse an EPW file without using the cache"""
+        # One pass over the records: text columns are read as strings, the others as float64
+        columns = sorted(list(EPW_FIELDS.items()) + list(EPW_TEXT_FIELDS.items()), key=lambda item: item[1])
+        dtype = [(name, "U64" if name in EPW_TEXT_FIELDS else np.float64) for name, _ in columns]
+        with open(path, "r", encoding="latin-1") as f:
+            header_lines = [f.readline().rstrip("\n") for _ in range(EPW_HEADER_LINES)]
+            records = np.loadtxt(f, delimiter=",", usecols=[column for _, column in columns], dtype=dtype, ndmin=1)
+
+        arrays = {}
+        for name in EPW_FIELDS:
+            if name in TIME_FIELDS:
+                arrays[name] = records[name].astype(np.int16)
+            elif name in FLAG_FIELDS:
+                arrays[name] = records[name].astype(np.int64)
+            else:
+                arrays[name] = records[name].astype(np.float32)
+        for name in EPW_TEXT_FIELDS:
+            arrays[name] = np.array(np.char.strip(records[name]).tolist())
+        return cls(header_lines, arrays)
+
+    @classmethod
+    def load(cls, path=EPW_PATH, cache_dir=WEATHER_CACHE_DIR, use_cache=True):
+        """
+        Load an EPW file, reusing the parsed arrays cached on disk under the file's hash
+        :param path: EPW file
+        :param cache_dir: Directory holding one .npz per parsed weather file
+        :param use_cache: Whether to read and write the disk cache
+        """
+        if not use_cache:
+            return cls.parse(path)
+
+        key = file_hash(path)
+        if key in _memory_cache:
+            return _memory_cache[key]
+
+        cache_path = os.path.join(cache_dir, f"{key}.v{CACHE_VERSION}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                weather = cls([str(line) for line in cached["header_lines"]],
+                              {name: cached[name] for name in list(EPW_FIELDS) + list(EPW_TEXT_FIELDS)})
+        else:
+            weather = cls.parse(path)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, header_lines=np.array(weather.header_lines), **weather.arrays)
+            os.replace(tmp_path, cache_path)
+
+        _memory_cache[key] = weather
+        return weather
+
+    def __len__(self):
+        return len(self.arrays["hour"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def _header(self, keyword):
+        for line in self.header_lines:
+            if line.upper().startswith(keyword):
+                return line.split(",")[1:]
+        return []
+
+    @cached_property
+    def location(self):
+        """Location header: city, state, country, source, WMO station, latitude, longitude, time zone, elevation"""
+        fields = self._header("LOCATION") + [""] * 9
+        return {
+            "city": fields[0],
+            "state": fields[1],
+            "country": fields[2],
+            "source": fields[3],
+            "wmo": fields[4],
+            "latitude": float(fields[5] or 0),
+            "longitude": float(fields[6] or 0),
+            "time_zone": float(fields[7] or 0),
+            "elevation": float(fields[8] or 0),
+        }
+
+    @cached_property
+    def design_conditions(self):
+        """Design conditions header as its raw fields (empty when the file declares none)"""
+        fields = self._header("DESIGN CONDITIONS")
+        if not fields or fields[0].strip() in ("", "0"):
+            return []
+        return fields[1:]
+
+    @cached_property
+    def times(self):
+        """End of every hourly record as datetime64 (hour 24 is midnight of the next day)"""
+        year = int(self.arrays["year"][0])
+        hours = (np.arange(len(self)) + 1).astype("timedelta64[h]")
+        return np.datetime64(f"{year:04d}-01-01T00:00", "m") + hours
+
+    def interpolate(self, step_minutes=10, fields=None):
+        """
+        Linearly interpolate hourly records to a sub-hourly timestep, as EnergyPlus does for its own timesteps.
+        The value at midnight of January 1st wraps around to the last record, as in EnergyPlus.
+        :param step_minutes: Timestep in minutes (10 for the rest of the pipeline)
+        :param fields: Names of the fields to interpolate (default: every physical quantity, no time or flag field)
+        :return: Dict with a datetime64 'time' array and one float32 array per field
+        """
+        if 60 % step_minutes:
+            raise ValueError(f"The timestep must divide an hour, got {step_minutes} minutes")
+
+        fields = fields or [name for name in EPW_FIELDS if name not in TIME_FIELDS + FLAG_FIELDS]
+        codes = [name for name in fields if name in FLAG_FIELDS or name in EPW_TEXT_FIELDS]
+        if codes:
+            raise ValueError(f"Code and flag fields cannot be interpolated: {', '.join(codes)}")
+        steps_per_hour = 60 // step_minutes
+        source_hours = np.arange(0, len(self) + 1, dtype=np.float64)
+        target_minutes = np.arange(1, len(self) * steps_per_hour + 1, dtype=np.int64) * step_minutes
+        target_hours = target_minutes / 60
+
+        result = {
+            "time": np.datetime64(f"{int(self.arrays['year'][0]):04d}-01-01T00:00", "m")
+                    + target_minutes.astype("timedelta64[m]")
+        }
+        for name in fields:
+            values = self.arrays[name].astype(np.float64)
+            values = np.concatenate((values[-1:], values))
+            if name == "wind_direction":
+                # Interpolate the direction on the unit circle so 350 -> 10 degrees passes through north
+                radians = np.deg2rad(values)
+                sin = np.interp(target_hours, source_hours, np.sin(radians))
+                cos = np.interp(target_hours, source_hours, np.cos(radians))
+                interpolated = np.rad2deg(np.arctan2(sin, cos)) % 360
+            else:
+                interpolated = np.interp(target_hours, source_hours, values)
+            result[name] = interpolated.astype(np.float32)
+        return result
+
+
+if __name__ == "__main__":
+    weather = EPWWeather.load()
+    print(f"{len(weather)} hourly records for {weather.location['city']}, {weather.location['country']}")
+    sub_hourly = weather.interpolate(step_minutes=10, fields=["dry_bulb_temperature"])
+    print(f"{len(sub_hourly['time'])} records at 10 minutes, first: {sub_hourly['time'][0]} "
+          f"{sub_hourly['dry_bulb_temperature'][0]:.2f} C")
@@ -0,0 +1,206 @@
+import numpy as np
+from src.constants import (STATS_FIELDS, STATS_QUANTILES, STATS_EWMA_ALPHA, STATS_Z_THRESHOLD, STATS_MIN_SAMPLES)
+
+
+def _p2_update(heights, positions, desired, increments, x):
+    """
+    One step of the P-square quantile estimator (Jain & Chlamtac, 1985) for M independent sketches
+    :param heights: (M, 5) marker heights, updated in place
+    :param positions: (M, 5) actual marker positions, updated in place
+    :param desired: (M, 5) desired marker positions, updated in place
+    :param increments: (M, 5) increments of the desired positions
+    :param x: (M,) new observation of every sketch
+    """
+    below = x < heights[:, 0]
+    heights[below, 0] = x[below]
+    above = x > heights[:, 4]
+    heights[above, 4] = x[above]
+
+    # Cell k such that heights[k] <= x < heights[k + 1]; markers after it move one position up
+    cell = np.sum(x[:, None] >= heights[:, 1:4], axis=1)
+    positions += np.arange(5)[None, :] > cell[:, None]
+    desired += increments
+
+    rows = np.arange(len(x))
+    for i in (1, 2, 3):
+        d = desired[:, i] - positions[:, i]
+        move = (((d >= 1) & (positions[:, i + 1] - positions[:, i] > 1))
+                | ((d <= -1) & (positions[:, i - 1] - positions[:, i] < -1)))
+        if not move.any():
+            continue
+
+        s = np.sign(d[move])
+        q = heights[move]
+        n = positions[move]
+        parabolic = q[:, i] + s / (n[:, i + 1] - n[:, i - 1]) * (
+                (n[:, i] - n[:, i - 1] + s) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i])
+                + (n[:, i + 1] - n[:, i] - s) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1]))
+        neighbour = i + s.astype(np.int64)
+        moved_rows = rows[:len(s)]
+        linear = q[:, i] + s * (q[moved_rows, neighbour] - q[:, i]) / (n[moved_rows, neighbour] - n[:, i])
+
+        q[:, i] = np.where((q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1]), parabolic, linear)
+        n[:, i] += s
+        heights[move] = q
+        positions[move] = n
+
+
+class ZoneStatistics:
+    def __init__(self, fields=STATS_FIELDS, quantiles=STATS_QUANTILES, ewma_alpha=STATS_EWMA_ALPHA,
+                 z_threshold=STATS_Z_THRESHOLD, min_samples=STATS_MIN_SAMPLES, capacity=64):
+        """
+        Running statistics of every zone and field, updated in O(1) per reading and kept in NumPy arrays
+        (one row per zone, one column per field): Welford mean/variance, EWMA and P-square quantile sketches.
+        :param fields: Thermal zone fields to track
+        :param quantiles: Quantiles estimated per field; the last one is the alert threshold (None to disable)
+        :param ewma_alpha: Weight of the newest reading in the EWMA
+        :param z_threshold: |z-score| above which a reading is flagged (None to disable)
+        :param min_samples: Readings of a zone and field needed before its readings are scored
+        :param capacity: Initial number of zone rows, doubled when exceeded
+        """
+        self.fields = list(fields)
+        self.quantiles = tuple(quantiles or ())
+        self.ewma_alpha = ewma_alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.rows = {}
+        self.keys = []
+        self.last_time = []
+
+        field_count, quantile_count = len(self.fields), len(self.quantiles)
+        self.count = np.zeros((capacity, field_count), dtype=np.int64)
+        self.mean = np.zeros((capacity, field_count))
+        self.m2 = np.zeros((capacity, field_count))
+        self.ewma = np.zeros((capacity, field_count))
+        self.heights = np.zeros((capacity, field_count, quantile_count, 5))
+        self.positions = np.zeros((capacity, field_count, quantile_count, 5))
+        self.desired = np.zeros((capacity, field_count, quantile_count, 5))
+
+        p = np.array(self.quantiles, dtype=np.float64).reshape(-1, 1)
+        self.increments = np.hstack([np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)])
+        self.initial_desired = np.hstack([np.ones_like(p), 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5 * np.ones_like(p)])
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+
+        row = self.rows[key] = len(self.keys)
+        self.keys.append(key)
+        self.last_time.append(None)
+        if row == len(self.count):
+            for name in ("count", "mean", "m2", "ewma", "heights", "positions", "desired"):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        return row
+
+    def update(self, building_id, zone_id, timestamp, fields):
+        """
+        Score a reading against the zone's statistics so far, then fold it in
+        :return: List of alert dicts, one per flagged field
+        """
+        row = self._row((building_id, zone_id))
+        self.last_time[row] = timestamp
+        x = np.array([fields.get(field, np.nan) for field in self.fields], dtype=np.float64)
+        valid = ~np.isnan(x)
+
+        alerts = self._score(row, x, valid)
+
+        # Welford mean / variance and EWMA
+        count = self.count[row]
+        count += valid
+        delta = np.where(valid, x - self.mean[row], 0.0)
+        self.mean[row] += np.where(valid, delta / np.maximum(count, 1), 0.0)
+        self.m2[row] += np.where(valid, delta * (x - self.mean[row]), 0.0)
+        self.ewma[row] = np.where(valid, np.where(count == 1, x, self.ewma_alpha * x
+                                                  + (1 - self.ewma_alpha) * self.ewma[row]), self.ewma[row])
+
+        if self.quantiles:
+            self._update_quantiles(row, x, valid)
+        return alerts
+
+    def _update_quantiles(self, row, x, valid):
+        count = self.count[row]
+        heights, positions, desired = self.heights[row], self.positions[row], self.desired[row]
+
+        # The first five readings of a field are the initial marker heights
+        for f in np.flatnonzero(valid & (count <= 5)):
+            heights[f, :, count[f] - 1] = x[f]
+            if count[f] == 5:
+                heights[f].sort(axis=-1)
+                positions[f] = np.arange(1, 6)
+                desired[f] = self.initial_desired
+
+        running = valid & (count > 5)
+        if running.any():
+            quantile_count = len(self.quantiles)
+            h, n, d = heights[running], positions[running], desired[running]
+            shape = h.shape
+            h, n, d = h.reshape(-1, 5), n.reshape(-1, 5), d.reshape(-1, 5)
+            increments = np.tile(self.increments, (int(running.sum()), 1))
+            _p2_update(h, n, d, increments, np.repeat(x[running], quantile_count))
+            heights[running], positions[running], desired[running] = \
+                h.reshape(shape), n.reshape(shape), d.reshape(shape)
+
+    def quantile(self, row, field_index, quantile_index):
+        """Current estimate of a quantile (exact over the first five readings)"""
+        count = self.count[row, field_index]
+        if count == 0:
+            return None
+        if count < 5:
+            return float(np.quantile(self.heights[row, field_index, quantile_index, :count],
+                                     self.quantiles[quantile_index]))
+        return float(self.heights[row, field_index, quantile_index, 2])
+
+    def _score(self, row, x, valid):
+        count = self.count[row]
+        scored = valid & (count >= self.min_samples)
+        if not scored.any():
+            return []
+
+        building_id, zone_id = self.keys[row]
+        std = np.sqrt(self.m2[row] / np.maximum(count - 1, 1))
+        alerts = []
+        for f in np.flatnonzero(scored):
+            z_score = (x[f] - self.mean[row, f]) / std[f] if std[f] > 0 else 0.0
+            threshold = self.quantile(row, f, len(self.quantiles) - 1) if self.quantiles else None
+            reasons = []
+            if self.z_threshold is not None and abs(z_score) > self.z_threshold:
+                reasons.append("z_score")
+            if threshold is not None and x[f] > threshold:
+                reasons.append("quantile")
+            if reasons:
+                alerts.append({
+                    "building_id": building_id,
+                    "zone_id": zone_id,
+                    "time": self.last_time[row],
+                    "field": self.fields[f],
+                    "value": float(x[f]),
+                    "reasons": reasons,
+                    "z_score": float(z_score),
+                    "mean": float(self.mean[row, f]),
+                    "std": float(std[f]),
+                    "quantile": self.quantiles[-1] if self.quantiles else None,
+                    "quantile_value": threshold
+                })
+        return alerts
+
+    def snapshot(self, building_id, zone_id):
+        """Current statistics of a zone as a JSON-serializable dict (None for an unknown zone)"""
+        row = self.rows.get((building_id, zone_id))
+        if row is None:
+            return None
+
+        fields = {}
+        for f, field in enumerate(self.fields):
+            count = int(self.count[row, f])
+            if not count:
+                continue
+            fields[field] = {
+                "count": count,
+                "mean": float(self.mean[row, f]),
+                "std": float(np.sqrt(self.m2[row, f] / (count - 1))) if count > 1 else 0.0,
+                "ewma": float(self.ewma[row, f]),
+                "quantiles": {str(q): self.quantile(row, f, i) for i, q in enumerate(self.quantiles)}
+            }
+        return {"building_id": building_id, "zone_id": zone_id, "time": self.last_time[row], "fields": fields}
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import api
+from storage import ColumnarStore, InfluxBackend, Record, SeriesQuery, page_records
+
+T0 = datetime(2005, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ColumnarStore(tmp_path, flush_interval=60)
+    monkeypatch.setattr(api, "backend", store)
+    yield store
+    store.close()
+
+
+def test_cursor_round_trip():
+    cursor = api.encode_cursor({"m": "thermal_zone", "t": at(10).isoformat(), "b": "", "z": "Z1"})
+    assert "=" not in cursor
+    assert api.decode_cursor(cursor, ["m", "t", "b", "z"]) == {"m": "thermal_zone", "t": at(10), "b": "", "z": "Z1"}
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", api.encode_cursor({"t": "2005-01-01T00:00:00Z"}), "W10"])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        api.decode_cursor(cursor, ["m", "t", "b", "z"])
+    assert error.value.status_code == 400
+
+
+def test_pages_split_equal_timestamps_across_series(store):
+    for minute in range(3):
+        for zone_id in ("Z1", "Z2", "Z3"):
+            store.write("thermal_zone", {"zone_id": zone_id}, at(minute), {"mean_air_temperature": minute})
+    store.write("site_metrics", {}, at(0), {"outdoor_air_temp": 5})
+    store.flush()
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = asyncio.run(api.data_page(["thermal_zone", "site_metrics"], None, None, None, None,
+                                                 "raw", 4, cursor))
+        pages.append([(measurement, record.values["_time"], record.values.get("zone_id"))
+                      for measurement, record in page])
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert [key for page in pages for key in page] == (
+        [("thermal_zone", at(minute), zone_id) for minute in range(3) for zone_id in ("Z1", "Z2", "Z3")]
+        + [("site_metrics", at(0), None)])
+
+
+def test_cursor_of_another_data_type_is_rejected(store):
+    cursor = api.encode_cursor({"m": "site_metrics", "t": at(0).isoformat(), "b": "", "z": ""})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(api.data_page(["thermal_zone"], None, None, None, None, "raw", 4, cursor))
+    assert error.value.status_code == 400
+
+
+def test_flux_reads_one_more_point_after_a_keyset_position():
+    backend = InfluxBackend("http://localhost:8086", "token", "org", "bucket")
+    assert "limit(n: 3)" in backend.flux(SeriesQuery("thermal_zone", limit=3))
+    assert "limit(n: 4)" in backend.flux(SeriesQuery("thermal_zone", after=(at(0), "", "Z1"), limit=3))
+
+
+def test_page_records_skip_the_keyset_position_and_trim_to_the_limit():
+    records = [Record({"_time": at(minute), "zone_id": zone_id}) for minute in range(2) for zone_id in ("Z1", "Z2")]
+    query = SeriesQuery("thermal_zone", after=(at(0).isoformat(), "", "Z1"), limit=2)
+    assert [(record.values["_time"], record.values["zone_id"]) for record in page_records(records, query)] == [
+        (at(0), "Z2"), (at(1), "Z1")]
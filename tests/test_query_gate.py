@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+import pytest
+
+from query_gate import QueryGate, QueryShed
+
+
+def blocking(release: threading.Event, result):
+    """Query standing in for the database: returns result once released"""
+    def execute():
+        release.wait(5)
+        return result
+    return execute
+
+
+def test_identical_queries_share_one_execution():
+    async def scenario():
+        gate = QueryGate(2, 8)
+        release = threading.Event()
+        calls = []
+
+        def execute():
+            calls.append(1)
+            release.wait(5)
+            return "rows"
+
+        waiters = [asyncio.ensure_future(gate.run("q", execute)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*waiters), calls, gate.metrics()
+
+    results, calls, metrics = asyncio.run(scenario())
+    assert results == ["rows"] * 3
+    assert len(calls) == 1
+    assert metrics["coalesced"] == 2 and metrics["executed"] == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_query():
+    async def scenario():
+        gate = QueryGate(1, 8)
+        release = threading.Event()
+        leader = asyncio.ensure_future(gate.run("q", blocking(release, "rows")))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(gate.run("q", blocking(release, "other")))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        release.set()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(scenario()) == ("rows", True)
+
+
+def test_abandoned_queued_query_never_runs():
+    async def scenario():
+        gate = QueryGate(1, 8)
+        release = threading.Event()
+        ran = []
+        running = asyncio.ensure_future(gate.run("a", blocking(release, "a")))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(gate.run("b", lambda: ran.append("b")))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await running
+        await asyncio.sleep(0.05)
+        return ran, gate.metrics()
+
+    ran, metrics = asyncio.run(scenario())
+    assert ran == []
+    assert metrics["queued"] == 0 and metrics["executed"] == 1
+
+
+def test_queries_beyond_the_queue_are_shed():
+    async def scenario():
+        gate = QueryGate(1, 1)
+        release = threading.Event()
+        running = asyncio.ensure_future(gate.run("a", blocking(release, "a")))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(gate.run("b", blocking(release, "b")))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(QueryShed):
+                await gate.run("c", blocking(release, "c"))
+        finally:
+            release.set()
+        return await asyncio.gather(running, queued), gate.metrics()["shed"]
+
+    assert asyncio.run(scenario()) == (["a", "b"], 1)
+
+
+def test_failure_is_shared_by_every_caller():
+    async def scenario():
+        gate = QueryGate(1, 8)
+        release = threading.Event()
+
+        def execute():
+            release.wait(5)
+            raise RuntimeError("storage down")
+
+        waiters = [asyncio.ensure_future(gate.run("q", execute)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True), gate.metrics()["failed"]
+
+    errors, failed = asyncio.run(scenario())
+    assert [str(error) for error in errors] == ["storage down", "storage down"]
+    assert failed == 1
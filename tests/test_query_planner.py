@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from query_planner import RangeSplitter, merge_tables, plan_time_shards, plan_zone_shards
+from storage import Record, Table
+
+T0 = datetime(2005, 1, 1, tzinfo=timezone.utc)
+ZONES = ["Z1", "Z2", "Z3", "Z4", "Z5"]
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def build_query(start, stop, zone_ids):
+    return start, stop, tuple(zone_ids) if zone_ids is not None else None
+
+
+def series(minutes, zone_id):
+    return Table([Record({"_time": at(minute), "zone_id": zone_id}) for minute in minutes])
+
+
+def test_time_shards_cover_the_range():
+    assert plan_time_shards(at(0), at(25), timedelta(minutes=10)) == [
+        (at(0), at(10)), (at(10), at(20)), (at(20), at(25))]
+    assert plan_time_shards(at(0), at(25), None) == [(at(0), at(25))]
+    assert plan_time_shards(at(0), at(25), timedelta(0)) == [(at(0), at(25))]
+
+
+def test_zone_shards_split_the_selection():
+    assert plan_zone_shards(ZONES, 2) == [["Z1", "Z3", "Z5"], ["Z2", "Z4"]]
+    assert plan_zone_shards(ZONES[:2], 4) == [["Z1"], ["Z2"]]
+    assert plan_zone_shards(None, 4) == [None]
+    assert plan_zone_shards(ZONES, 1) == [ZONES]
+
+
+def test_merged_tables_are_time_ordered():
+    merged = merge_tables([series([0, 2, 4], "Z2"), series([1, 2, 3], "Z1")])
+    assert [(record.values["_time"], record.values["zone_id"]) for record in merged] == [
+        (at(0), "Z2"), (at(1), "Z1"), (at(2), "Z1"), (at(2), "Z2"), (at(3), "Z1"), (at(4), "Z2")]
+
+
+def test_splitter_streams_in_order_within_its_parallelism():
+    running = {"now": 0, "peak": 0}
+
+    async def run_query(query):
+        start, stop, zone_ids = query
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        # Later shards answer first: the output order must not depend on completion order
+        await asyncio.sleep(0.01 * (30 - start.minute) / 10)
+        running["now"] -= 1
+        return [series(range(start.minute, stop.minute, 5), zone_id) for zone_id in zone_ids]
+
+    async def scenario():
+        splitter = RangeSplitter(run_query, 2)
+        return [record async for record in splitter.records(
+            build_query, plan_time_shards(at(0), at(30), timedelta(minutes=10)), plan_zone_shards(ZONES, 3))]
+
+    records = asyncio.run(scenario())
+    assert running["peak"] == 2
+    assert [(record.values["_time"], record.values["zone_id"]) for record in records] == [
+        (at(minute), zone_id) for minute in range(0, 30, 5) for zone_id in ZONES]
+
+
+def test_splitter_cancels_the_queries_read_ahead_when_closed():
+    cancelled = []
+
+    async def run_query(query):
+        start, stop, zone_ids = query
+        try:
+            await asyncio.sleep(0 if start == at(0) else 5)
+        except asyncio.CancelledError:
+            cancelled.append(start)
+            raise
+        return [series([start.minute], None)]
+
+    async def scenario():
+        stream = RangeSplitter(run_query, 3).records(
+            build_query, plan_time_shards(at(0), at(30), timedelta(minutes=10)), [None])
+        first = await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(scenario()).values["_time"] == at(0)
+    assert sorted(cancelled) == [at(10), at(20)]
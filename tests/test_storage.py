@@ -0,0 +1,121 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from storage import ColumnarStore, SeriesQuery
+
+T0 = datetime(2005, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def rows(store, query):
+    """Records of a query as (time, zone_id, fields...) tuples, in table order"""
+    return [tuple(record.values.get(column) for column in ["_time", "zone_id"] + list(query.fields or ()))
+            for table in store.query(query) for record in table.records]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ColumnarStore(tmp_path, segment_rows=4, flush_interval=60)
+    yield store
+    store.close()
+
+
+def test_round_trip(store):
+    for minute in range(6):
+        store.write("thermal_zone", {"zone_id": "Z1"}, at(minute), {"mean_air_temperature": 20 + minute})
+    store.flush()
+
+    query = SeriesQuery("thermal_zone", at(1), at(4), fields=("mean_air_temperature",))
+    assert rows(store, query) == [(at(minute), "Z1", 20.0 + minute) for minute in (1, 2, 3)]
+
+
+def test_full_segments_are_sealed_in_the_index(store, tmp_path):
+    for minute in range(9):
+        store.write("thermal_zone", {"zone_id": "Z1"}, at(minute), {"mean_air_temperature": minute})
+    store.flush()
+
+    (series,) = os.listdir(tmp_path / "thermal_zone")
+    index = ColumnarStore.read_index(tmp_path / "thermal_zone" / series)
+    assert sorted(index) == ["0", "1"]
+    assert index["1"]["min"] == int(at(4).timestamp()) * 10 ** 9
+    assert index["1"]["sorted"]
+
+    query = SeriesQuery("thermal_zone", at(3), at(9), fields=("mean_air_temperature",))
+    assert [row[2] for row in rows(store, query)] == [3.0, 4.0, 5.0, 6.0, 7.0, 8.0]
+    assert store.bounds(SeriesQuery("thermal_zone")) == (at(0), at(8))
+
+
+def test_rewritten_points_keep_the_fields_they_do_not_carry(store):
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(0), {"mean_air_temperature": 20, "air_co2_concentration": 400})
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(1), {"mean_air_temperature": 21})
+    store.flush()
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(0), {"mean_air_temperature": 22})
+    store.flush()
+
+    query = SeriesQuery("thermal_zone", fields=("mean_air_temperature", "air_co2_concentration"))
+    assert rows(store, query) == [(at(0), "Z1", 22.0, 400.0), (at(1), "Z1", 21.0, None)]
+
+
+def test_keyset_pages_cover_every_point_once(store):
+    for minute in range(5):
+        for zone_id in ("Z1", "Z2"):
+            store.write("thermal_zone", {"zone_id": zone_id}, at(minute), {"mean_air_temperature": minute})
+    store.flush()
+
+    seen, after = [], None
+    while True:
+        query = SeriesQuery("thermal_zone", fields=("mean_air_temperature",), after=after, limit=3)
+        page = sorted(rows(store, query))[:3]
+        if not page:
+            break
+        seen.extend(page)
+        after = (page[-1][0].isoformat(), "", page[-1][1])
+    assert seen == sorted((at(minute), zone_id, float(minute)) for minute in range(5) for zone_id in ("Z1", "Z2"))
+
+
+def test_failed_flush_keeps_the_points_and_cuts_partial_writes(store, monkeypatch):
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(0), {"mean_air_temperature": 20})
+    store.flush()
+    (writer,) = store.writers.values()
+    with open(writer.segment_path("mean_air_temperature.f8"), "ab") as f:
+        f.write(np.float64(99).tobytes())
+
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(1), {"mean_air_temperature": 21})
+
+    def disk_full(times, values):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(writer, "write_segment", disk_full)
+        store.flush()
+    assert len(writer.times) == 1
+
+    store.flush()
+    assert writer.times == []
+    query = SeriesQuery("thermal_zone", fields=("mean_air_temperature",))
+    assert rows(store, query) == [(at(0), "Z1", 20.0), (at(1), "Z1", 21.0)]
+
+
+def test_generation_changes_on_rewrites_and_deletes_only(store):
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(0), {"mean_air_temperature": 20})
+    store.flush()
+    started = store.generation()
+    assert started is not None
+
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(1), {"mean_air_temperature": 21})
+    store.flush()
+    assert store.generation() == started
+
+    store.write("thermal_zone", {"zone_id": "Z1"}, at(1), {"mean_air_temperature": 22})
+    store.flush()
+    rewritten = store.generation()
+    assert rewritten != started
+
+    store.delete(["thermal_zone"])
+    assert store.generation() not in (started, rewritten)